@@ -0,0 +1,277 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Benchmark Module
+# It times every stage of the processing chain and measures its peak memory
+# while one radar parameter (or the number of targets) is swept at a time
+# around the test_config radar. The results are written one json line per
+# measurement so they can be compared between runs. It runs without a
+# display: python benchmark.py --output results.jsonl
+# The cached data (windows, steering grids, FFT plans) is warm when a stage
+# is timed, except for the chirp which is generated again on every call.
+
+import json
+import tracemalloc
+import platform
+from time import perf_counter
+from datetime import datetime, timezone
+from argparse import ArgumentParser
+from statistics import median
+from math import log2
+import numpy
+from numpy import linspace
+from test_config import RADAR
+from configuration import radarConfig
+from transmitter import chirpGenerator, sequenceGenerator, waveformBank
+from environment import RadarTarget, radarChannel
+from targets import TargetTable
+from receiver import rangeDopplerProcessing, angleEstimation
+from common import findTargets
+from integration import integrateChannels
+from visualization import headless
+
+# Values of every swept parameter, the other parameters keep the value of
+# test_config
+SIZES = {
+    "Time Samples in Chirp": [128, 256, 512, 1024],
+    "Number of Chirps": [64, 128, 256, 512],
+    "Array Size": [4, 8, 16, 32],
+    "Total Targets": [1, 4, 16, 64, 256]
+}
+QUICK_SIZES = {
+    "Time Samples in Chirp": [128, 256],
+    "Number of Chirps": [32, 64],
+    "Array Size": [2, 4],
+    "Total Targets": [1, 4]
+}
+
+def benchmarkEnvironment(radar, totalTargets):
+    """
+    This function spreads the targets over the range, velocity and angle 
+    that the radar can measure
+    :param radar: RadarConfig
+    :param totalTargets: integer
+    :return TargetTable
+    """
+    return TargetTable(linspace(0.1, 0.8, totalTargets) * radar.maxRange, \
+        linspace(-0.4, 0.4, totalTargets) * radar.velocityBin * \
+        radar.totalChirps, linspace(-50, 50, totalTargets))
+
+def benchmarkStages(radar, environment):
+    """
+    This function prepares the inputs of every stage and returns the calls
+    that are measured, each stage gets the output of the one before it
+    :param radar: RadarConfig
+    :param environment: TargetTable
+    :return dict of name: function without arguments
+    """
+    totalTargets = len(environment)
+    chirpSignal = chirpGenerator(radar, False)
+    transmitSequence = sequenceGenerator(radar, chirpSignal, False)
+    receivedSequence = radarChannel(radar, environment, transmitSequence, \
+        seed=0)
+    radarCube = rangeDopplerProcessing(radar, transmitSequence, \
+        receivedSequence, halfSpectrum=True)
+    powerMap = integrateChannels(radar, radarCube)
+    targetIndices = findTargets(powerMap, totalTargets)
+    target = RadarTarget(environment.range[0], environment.velocity[0])
+
+    def generateChirp():
+        # The chirp is taken out of the bank so it is really generated
+        waveformBank.clear()
+        return chirpGenerator(radar, False)
+
+    return {
+        "chirpGenerator": generateChirp,
+        "sequenceGenerator": lambda: sequenceGenerator(radar, chirpSignal, \
+            False),
+        "RadarTarget.reflect": lambda: target.reflect(radar, \
+            transmitSequence, seed=0),
+        "radarChannel": lambda: radarChannel(radar, environment, \
+            transmitSequence, seed=0),
+        "rangeDopplerProcessing": lambda: rangeDopplerProcessing(radar, \
+            transmitSequence, receivedSequence, halfSpectrum=True),
+        "integrateChannels": lambda: integrateChannels(radar, radarCube),
+        "integrateChannels Max Beam": lambda: integrateChannels(radar, \
+            radarCube, "Max Beam"),
+        "findTargets": lambda: findTargets(powerMap, totalTargets),
+        "angleEstimation": lambda: angleEstimation(radar, radarCube, \
+            targetIndices),
+        "angleEstimation MUSIC": lambda: angleEstimation(radar, radarCube, \
+            targetIndices, "MUSIC")
+    }
+
+def measure(function, repeat=5):
+    """
+    This function times a call and measures its peak memory. The memory is
+    measured in a separate call because tracing slows the call down.
+    :param function: function without arguments
+    :param repeat: integer, timed calls
+    :return dict
+    """
+    # The first call warms the caches and is not timed
+    function()
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+
+    # Peak of the memory allocated during the call
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    function()
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    return {"median": median(times), "min": min(times), "repeat": repeat, \
+        "peakBytes": peak}
+
+def runBenchmarks(sizes=None, repeat=5, stages=None, radar=None, log=True):
+    """
+    This function sweeps every parameter of sizes one at a time and measures
+    all the stages for every value
+    :param sizes: dict of parameter: values, see SIZES
+    :param repeat: integer, timed calls of every stage
+    :param stages: list of string, all the stages by default
+    :param radar: dict, base configuration, test_config by default
+    :param log: boolean, print every measurement
+    :return list of dict, one per stage and value
+    """
+    sizes = SIZES if sizes is None else sizes
+    baseRadar = radarConfig(RADAR if radar is None else radar).toDict()
+    run = {"time": datetime.now(timezone.utc).isoformat(), \
+        "python": platform.python_version(), "numpy": numpy.__version__, \
+        "machine": platform.machine(), "processor": platform.processor()}
+    results = []
+    for parameter, values in sizes.items():
+        for value in values:
+            # Only the swept parameter changes
+            radar = dict(baseRadar)
+            totalTargets = 2
+            if parameter == "Total Targets":
+                totalTargets = value
+            else:
+                radar[parameter] = value
+            radar = radarConfig(radar)
+            environment = benchmarkEnvironment(radar, totalTargets)
+            for name, function in benchmarkStages(radar, environment).items():
+                if stages is not None and name not in stages:
+                    continue
+                result = dict(run, stage=name, parameter=parameter, \
+                    value=value, samples=radar.totalSamples, \
+                    chirps=radar.totalChirps, channels=radar.arraySize, \
+                    targets=totalTargets, **measure(function, repeat))
+                results.append(result)
+                if log:
+                    print("{:24s} {:>22s} = {:<5d} {:10.3f}ms {:10.2f}MB" \
+                        .format(name, parameter, value, \
+                        result["median"] * 1e3, result["peakBytes"] / 2 ** 20))
+    return results
+
+def writeResults(results, fileName):
+    """
+    This function appends the results to a json lines file
+    :param results: list of dict, see runBenchmarks
+    :param fileName: string
+    """
+    with open(fileName, "a") as file:
+        for result in results:
+            file.write(json.dumps(result) + "\n")
+
+def readResults(fileName):
+    """
+    This function reads the results of a json lines file, the last result of
+    every stage, parameter and value is kept
+    :param fileName: string
+    :return dict of (stage, parameter, value): dict
+    """
+    with open(fileName) as file:
+        results = [json.loads(line) for line in file if line.strip()]
+    return {(result["stage"], result["parameter"], result["value"]): result \
+        for result in results}
+
+def scalingExponents(results):
+    """
+    This function estimates how every stage scales with every parameter: the
+    slope of log(time) over log(value) between two neighbouring values. A 
+    slope well above the one of the smaller values shows where the scaling
+    breaks (cache sizes, memory bandwidth, swapping).
+    :param results: list of dict, see runBenchmarks
+    :return dict of (stage, parameter): list of (value, slope)
+    """
+    series = {}
+    for result in results:
+        series.setdefault((result["stage"], result["parameter"]), []).append( \
+            (result["value"], result["median"]))
+    exponents = {}
+    for key, points in series.items():
+        points.sort()
+        exponents[key] = [(value, log2(time / lastTime) / log2(value / \
+            lastValue)) for (lastValue, lastTime), (value, time) in \
+            zip(points[:-1], points[1:]) if lastTime > 0]
+    return exponents
+
+def compareResults(baseline, results, tolerance=0.2):
+    """
+    This function finds the measurements that got slower or use more memory
+    than the baseline by more than the tolerance
+    :param baseline: dict, see readResults
+    :param results: list of dict, see runBenchmarks
+    :param tolerance: float, relative change that is allowed
+    :return list of (stage, parameter, value, quantity, baseline, result)
+    """
+    regressions = []
+    for result in results:
+        key = (result["stage"], result["parameter"], result["value"])
+        if key not in baseline:
+            continue
+        for quantity in ("median", "peakBytes"):
+            if result[quantity] > (1 + tolerance) * baseline[key][quantity]:
+                regressions.append(key + (quantity, baseline[key][quantity], \
+                    result[quantity]))
+    return regressions
+
+def test_benchmark():
+    # A quick sweep of the small sizes and the scaling of every stage
+    results = runBenchmarks(QUICK_SIZES, repeat=2)
+    for (stage, parameter), slopes in scalingExponents(results).items():
+        print("{:24s} {:>22s}: {}".format(stage, parameter, ", ".join( \
+            "{:.2f}".format(slope) for _, slope in slopes)))
+
+# Run this file to benchmark the stages and store the results
+if __name__ == '__main__':
+    parser = ArgumentParser(description="Benchmark the FMCW processing chain")
+    parser.add_argument("--output", default="benchmark.jsonl", \
+        help="json lines file the results are appended to")
+    parser.add_argument("--baseline", help="json lines file of an earlier " \
+        "run, the regressions against it are reported")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", \
+        help="only sweep the small sizes")
+    parser.add_argument("--stage", action="append", dest="stages", \
+        help="only measure this stage, can be given more than once")
+    arguments = parser.parse_args()
+    # The benchmark never shows a figure, importing it leaves the backend
+    # of the caller alone
+    headless()
+
+    results = runBenchmarks(QUICK_SIZES if arguments.quick else SIZES, \
+        arguments.repeat, arguments.stages)
+    writeResults(results, arguments.output)
+    for (stage, parameter), slopes in scalingExponents(results).items():
+        print("Scaling of {} with {}: {}".format(stage, parameter, ", ".join( \
+            "{:.2f} at {}".format(slope, value) for value, slope in slopes)))
+    if arguments.baseline:
+        regressions = compareResults(readResults(arguments.baseline), \
+            results, arguments.tolerance)
+        for regression in regressions:
+            print("Regression of {} ({} = {}) {}: {:.4g} -> {:.4g}".format( \
+                *regression))
+        if regressions:
+            raise SystemExit(1)
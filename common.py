@@ -8,36 +8,291 @@
 
 # FMCW Common Module
 
-from test_config import RADAR
+from configuration import radarConfig
 from math import pi
-from scipy.constants import k
-from numpy import log, abs, angle, argmax, unravel_index
-from numpy.fft import fftshift, fft
-from numpy.random import normal
-
-
-def powerSpectrum(input):
-    return 20 * log(abs(fftshift(fft(input, \
-        n=RADAR["Time Samples in Chirp"]))))
-
-def phaseSpectrum(input):
-    return (180 / pi) * angle(fftshift(fft(input, \
-        n=RADAR["Time Samples in Chirp"])))
-
-def addNoise(RADAR, data):
-    bandwidth = RADAR["Time Samples in Chirp"] / RADAR["Chirp Time"]
-    variance = k * RADAR["Operating Temperature"] * bandwidth * RADAR["Noise Figure"]
-    return data + normal(loc=0.0, scale=variance, size=data.shape)
-
-def findTargets(rangeDopplerMap, totalTargets):
-    maxIndices = []
-    for iTarget in range(totalTargets * 4):
-        index = unravel_index(argmax(rangeDopplerMap), rangeDopplerMap.shape)
-        maxIndices.append(index)
-        print(index)
-        rangeDopplerMap[index[0]-5:index[0]+5, :] = -float("inf")
-    return maxIndices
-
-def estimateAngle(snapShot):
-    angle = 0
-    return angle
\ No newline at end of file
+from functools import lru_cache
+from numpy import exp, arange, outer, ones, array, empty, add, iscomplexobj, \
+    sqrt, tile, repeat, moveaxis, uint64
+from numpy.fft import fft2, rfft2
+from numpy.random import Generator, PCG64, SeedSequence
+from detector import detectTargets
+from scipy.signal import get_window
+from scipy.special import ndtri
+
+
+def rangeAxis(radar, halfSpectrum=False):
+    """
+    This function returns the range in meters of every range bin of the radar
+    cube, centered on zero or only the positive ranges
+    :param radar: dict or RadarConfig
+    :param halfSpectrum: boolean
+    :return numpy.array
+    """
+    radar = radarConfig(radar)
+    return radar.halfRangeAxis if halfSpectrum else radar.rangeAxis
+
+def velocityAxis(radar):
+    """
+    This function returns the velocity in m/s (positive is approaching) of 
+    every doppler bin of the radar cube
+    :param radar: dict or RadarConfig
+    :return numpy.array
+    """
+    return radarConfig(radar).velocityAxis
+
+def noiseGenerator(seed=None, frame=0, channel=0):
+    """
+    This function returns the random generator of the noise of one channel
+    of one frame. The stream only depends on the seed and its position, not
+    on the process or the order it is drawn in, so parallel runs with the
+    same seed are reproducible.
+    :param seed: integer, fresh entropy for every call by default
+    :param frame: integer, index of the frame (or scenario)
+    :param channel: integer, index of the channel
+    :return numpy.random.Generator
+    """
+    return Generator(PCG64(SeedSequence(seed, spawn_key=(frame, channel))))
+
+def addNoise(RADAR, data, gain=1.0, seed=None, frame=0, firstChirp=0, \
+    buffer=None):
+    """
+    This function adds the receiver noise to the signal of every channel in
+    place. Complex signals get complex noise of the same power, split over
+    the real and imaginary parts. The noise of each channel is drawn from 
+    its own generator, see noiseGenerator, with one draw per real value so
+    a block of chirps skips the draws of the chirps before it. The noise of
+    a frame is then the same for any block size. It is always drawn in 
+    double precision, so a seed gives the same noise in every precision.
+    :param RADAR: dict or RadarConfig
+    :param data: numpy.array of shape (channels, ...) of whole chirps
+    :param gain: float, scale of the noise
+    :param seed: integer, see noiseGenerator
+    :param frame: integer, see noiseGenerator
+    :param firstChirp: integer, index of the first chirp of the data in the
+        frame
+    :param buffer: numpy.array, optional contiguous buffer of the shape and
+        type of the data to draw the noise into
+    :return numpy.array, the data
+    """
+    radar = radarConfig(RADAR)
+    scale = gain * radar.noiseVariance
+    if buffer is None:
+        buffer = empty(data.shape, dtype=data.dtype)
+    # Complex samples are drawn as two real ones in the same call
+    samples = buffer.view(buffer.real.dtype).reshape((data.shape[0], -1))
+    drawsPerChirp = radar.totalSamples
+    if iscomplexobj(buffer):
+        scale = scale / sqrt(2)
+        drawsPerChirp *= 2
+    for iChannel in range(data.shape[0]):
+        bitGenerator = noiseGenerator(seed, frame, iChannel).bit_generator
+        bitGenerator.advance(firstChirp * drawsPerChirp)
+        # Uniform values in (0, 1) from the top 52 bits of every draw,
+        # turned into normal ones by the inverse normal distribution
+        uniform = ((bitGenerator.random_raw(samples.shape[1]) >> \
+            uint64(12)) + 0.5) * 2.0 ** -52
+        samples[iChannel] = ndtri(uniform, out=uniform)
+    samples *= scale
+    return add(data, buffer, out=data)
+
+def findTargets(powerMap, totalTargets):
+    """
+    This function returns the (doppler, range) indices of the strongest CFAR
+    detections in a power range doppler map (see 
+    integration.integrateChannels), see detector.detectTargets
+    :param powerMap: numpy.array, not modified
+    :param totalTargets: integer, expected number of targets
+    :return list of tuples
+    """
+    detections = detectTargets(powerMap, maxTargets=totalTargets * 4)
+    return list(zip(detections["doppler"].tolist(), \
+        detections["range"].tolist()))
+
+@lru_cache(maxsize=32)
+def cachedPlan(shape, dtype, backend, workers, real):
+    if backend == "numpy":
+        transform = rfft2 if real else fft2
+        def plan(cube, out):
+            return transform(cube, axes=(-2, -1), out=out)
+    elif backend == "scipy":
+        from scipy import fft as scipyFFT
+        transform = scipyFFT.rfft2 if real else scipyFFT.fft2
+        def plan(cube, out):
+            out[...] = transform(cube, axes=(-2, -1), overwrite_x=True, \
+                workers=workers)
+            return out
+    elif backend == "pyfftw":
+        from pyfftw import empty_aligned, builders
+        builder = builders.rfft2 if real else builders.fft2
+        # Measuring the plan is slow but done once per cube shape
+        transform = builder(empty_aligned(shape, dtype=dtype), \
+            axes=(-2, -1), threads=workers, overwrite_input=True, \
+            planner_effort="FFTW_MEASURE")
+        def plan(cube, out):
+            out[...] = transform(cube)
+            return out
+    else:
+        raise ValueError("Unknown FFT backend: " + str(backend))
+    return plan
+
+def fftPlan(shape, dtype, backend="numpy", workers=1, real=False):
+    """
+    This function returns a function that calculates the 2D FFT over the last
+    two axes of a cube of the given shape. The plan is created only once per 
+    shape and backend, the least recently used plans are dropped. The 
+    complex transform can be done in place, the real transform only keeps 
+    the positive frequencies of the last axis.
+    :param shape: tuple
+    :param dtype: numpy.dtype, type of the input cube
+    :param backend: string, "numpy", "scipy" or "pyfftw"
+    :param workers: integer, threads used by the scipy and pyfftw backends
+    :param real: boolean, real input transformed with rfft on the last axis
+    :return function (cube, out) that returns out
+    """
+    return cachedPlan(tuple(shape), str(dtype), backend, workers, real)
+
+@lru_cache(maxsize=16)
+def centerModulation(totalChirps, totalSamples):
+    """
+    This function returns the modulation that centers the zero frequency of a
+    2D FFT, the same as fftshift does afterwards but without the copy
+    :param totalChirps: integer
+    :param totalSamples: integer
+    :return numpy.array of shape (chirps, samples)
+    """
+    # A shift of N // 2 bins is a phase ramp of the same bins before the FFT
+    modulation = outer( \
+        exp(2j * pi * (totalChirps // 2) * arange(totalChirps) / totalChirps), \
+        exp(2j * pi * (totalSamples // 2) * arange(totalSamples) / totalSamples))
+    modulation.flags.writeable = False
+    return modulation
+
+@lru_cache(maxsize=16)
+def centerSign(totalChirps):
+    """
+    This function returns the real modulation per chirp that centers the zero
+    doppler of a real cube. Only an even number of chirps can be centered this
+    way, for an odd number it is all ones and fftshift is needed afterwards.
+    :param totalChirps: integer
+    :return numpy.array of shape (chirps, 1)
+    """
+    sign = ones((totalChirps, 1))
+    if totalChirps % 2 == 0:
+        sign[1::2] = -1
+    sign.flags.writeable = False
+    return sign
+
+@lru_cache(maxsize=32)
+def windowFunction(name, size, attenuation):
+    """
+    This function returns the window of the given name and size, read only
+    and shared by all the calls with the same parameters
+    :param name: string, "Rectangular", "Hann", "Hamming", "Blackman" or 
+        "Chebyshev"
+    :param size: integer
+    :param attenuation: float, sidelobe level in dB of the Chebyshev window
+    :return numpy.array
+    """
+    windows = {"Rectangular": "boxcar", "Hann": "hann", "Hamming": "hamming", \
+        "Blackman": "blackman", "Chebyshev": ("chebwin", attenuation)}
+    if name not in windows:
+        raise ValueError("Unknown window: " + str(name))
+    window = get_window(windows[name], size)
+    window.flags.writeable = False
+    return window
+
+@lru_cache(maxsize=16)
+def cachedWindowWeights(radar, halfSpectrum):
+    # Combined doppler and range window with the zero frequency centering
+    weights = outer(windowFunction(radar.dopplerWindow, radar.totalChirps, \
+        radar.chebyshevAttenuation), windowFunction(radar.rangeWindow, \
+        radar.totalSamples, radar.chebyshevAttenuation))
+    if halfSpectrum:
+        weights = (weights * centerSign(radar.totalChirps)).astype( \
+            radar.realType)
+    else:
+        weights = (weights * centerModulation(radar.totalChirps, \
+            radar.totalSamples)).astype(radar.complexType)
+    weights.flags.writeable = False
+    return weights
+
+def windowWeights(radar, halfSpectrum=False):
+    """
+    This function returns the weights applied to the mixer output before the
+    range doppler FFT: the range and doppler windows configured in the radar
+    and the modulation that centers the zero frequency. They are calculated 
+    once per configuration.
+    :param radar: dict or RadarConfig
+    :param halfSpectrum: boolean, real weights for the real range FFT
+    :return numpy.array of shape (chirps, samples)
+    """
+    return cachedWindowWeights(radarConfig(radar), halfSpectrum)
+
+@lru_cache(maxsize=16)
+def cachedCalibration(calibration, totalTransmitters, complexType):
+    # The receivers have the same calibration for every transmitter
+    gains = tile(array(calibration, dtype=complexType), \
+        totalTransmitters).reshape((-1, 1, 1))
+    gains.flags.writeable = False
+    return gains
+
+def channelCalibration(radar):
+    """
+    This function returns the complex gain and phase correction of every
+    (virtual) channel, or None when the radar has no calibration configured
+    :param radar: dict or RadarConfig
+    :return numpy.array of shape (channels, 1, 1)
+    """
+    radar = radarConfig(radar)
+    if radar.channelCalibration is None:
+        return None
+    return cachedCalibration(radar.channelCalibration, \
+        radar.totalTransmitters, radar.complexType)
+
+def compensationPhase(radar, velocityAxis):
+    # Transmit slot of every virtual channel times the doppler phase of one
+    # chirp at the velocity of every doppler bin
+    slots = repeat(arange(radar.totalTransmitters), radar.arraySize)
+    return exp(-1j * radar.dopplerConstant * outer(slots, velocityAxis))[ \
+        :, :, None].astype(radar.complexType)
+
+@lru_cache(maxsize=16)
+def cachedCompensation(radar):
+    phase = compensationPhase(radar, radar.velocityAxis)
+    phase.flags.writeable = False
+    return phase
+
+def dopplerCompensation(radar, velocityAxis=None):
+    """
+    This function returns the phase that removes the doppler shift between
+    the transmitters of a TDM MIMO radar. The chirps of transmitter t are t
+    chirps after the ones of the first transmitter, so a moving target has 
+    the doppler phase of t chirps on the virtual channels of transmitter t,
+    which would be taken for an angle. The velocity of the doppler bin is 
+    used, so an ambiguous velocity leaves a residual phase.
+    :param radar: dict or RadarConfig
+    :param velocityAxis: numpy.array, velocity of every doppler bin of the
+        cube, the one of the whole radar cube by default
+    :return numpy.array of shape (channels, doppler, 1), or None for a 
+        single transmitter
+    """
+    radar = radarConfig(radar)
+    if radar.totalTransmitters == 1:
+        return None
+    if velocityAxis is None:
+        return cachedCompensation(radar)
+    return compensationPhase(radar, velocityAxis)
+
+def virtualView(radar, block):
+    """
+    This function arranges the chirps of a block by transmitter without 
+    copying them, the chirps of a frame are sent by the transmitters in turn
+    :param radar: dict or RadarConfig
+    :param block: numpy.array of shape (..., chirps, samples), a whole 
+        number of turns of the transmitters
+    :return numpy.array of shape (transmitters, ..., chirps per transmitter,
+        samples)
+    """
+    totalTransmitters = radarConfig(radar).totalTransmitters
+    return moveaxis(block.reshape(block.shape[:-2] + (-1, totalTransmitters, \
+        block.shape[-1])), -2, 0)
\ No newline at end of file
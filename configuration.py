@@ -0,0 +1,339 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Configuration Module
+# RadarConfig is an immutable and hashable form of the RADAR dict of
+# test_config. It is validated once when it is created and calculates the
+# derived quantities (sample time, axes, resolutions, noise variance) only
+# the first time they are needed. It can still be read with the keys of the
+# dict, so the functions accept either form.
+# "Precision": "Single" stores the signals and radar cubes as float32 and
+# complex64, half the memory of "Double". The phases are still calculated in
+# double precision, so the cubes stay within about -135dB of the peak of the
+# double precision ones (see receiver.test_precision) and the targets and
+# their angles are the same. The rounding spurs are about 110dB below the
+# strongest target, below the sidelobe floor of detector.detectTargets. The
+# scipy FFT backend is the fast one in single precision, numpy.fft is slower
+# in single than in double.
+# A TDM MIMO radar has "Transmitter Positions": its transmitters take turns,
+# one chirp each, so a frame has "Number of Chirps" chirps per transmitter.
+# The radar cubes have one virtual channel per transmitter and receiver, at
+# the sum of their positions (in wavelengths), transmitter by transmitter.
+
+from math import pi
+from numbers import Integral
+from functools import lru_cache
+from scipy.constants import c, k
+from numpy import linspace, arange, array, diff, allclose, float32, \
+    float64, complex64, complex128
+
+# Keys of the RADAR dict and the attribute they are stored in, with the
+# default value of the optional ones
+KEYS = {
+    "Carrier Wavelength": "carrierWavelength",
+    "Range Resolution": "rangeResolution",
+    "Chirp Bandwidth": "chirpBandwidth",
+    "Chirp Time": "chirpTime",
+    "Time Samples in Chirp": "totalSamples",
+    "Number of Chirps": "totalChirps",
+    "Operating Temperature": "temperature",
+    "Antenna Gain": "antennaGain",
+    "Noise Figure": "noiseFigure",
+    "Array Size": "arraySize",
+    "Array Spacing": "arraySpacing",
+    "Range Window": "rangeWindow",
+    "Doppler Window": "dopplerWindow",
+    "Chebyshev Attenuation": "chebyshevAttenuation",
+    "Channel Calibration": "channelCalibration",
+    "IQ Transmitter": "iqTransmitter",
+    "Precision": "precision",
+    "Transmitter Positions": "transmitterPositions",
+    "Receiver Positions": "receiverPositions"
+}
+DEFAULTS = {
+    "Range Window": "Rectangular",
+    "Doppler Window": "Rectangular",
+    "Chebyshev Attenuation": 60,
+    "Channel Calibration": None,
+    "IQ Transmitter": False,
+    "Precision": "Double",
+    "Transmitter Positions": None,
+    "Receiver Positions": None
+}
+
+# Real and complex types of every precision
+PRECISIONS = {"Double": (float64, complex128), "Single": (float32, complex64)}
+
+def derived(function):
+    """
+    This decorator turns a method into a property that is only calculated
+    the first time it is read
+    :param function: function
+    :return property
+    """
+    name = function.__name__
+    def getter(self):
+        cache = object.__getattribute__(self, "derivedCache")
+        if name not in cache:
+            cache[name] = function(self)
+        return cache[name]
+    return property(getter, doc=function.__doc__)
+
+def hashableValue(value):
+    """
+    This function converts the numpy values and arrays and the lists of a
+    configuration to python values and tuples, to keep it hashable
+    :param value: any configuration value
+    :return value
+    """
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+    if isinstance(value, list):
+        value = tuple(value)
+    return value
+
+def readOnly(array):
+    array.flags.writeable = False
+    return array
+
+class RadarConfig():
+    """
+    RadarConfig class holds the radar configuration and its derived values.
+    """
+
+    __slots__ = tuple(KEYS.values()) + ("derivedCache",)
+
+    def __init__(self, **values):
+        """
+        RadarConfig object constructor that takes the values with the
+        attribute names of KEYS, see also fromDict
+        """
+        for key, name in KEYS.items():
+            if name in values:
+                value = values.pop(name)
+            elif key in DEFAULTS:
+                value = DEFAULTS[key]
+            else:
+                raise ValueError("Missing radar parameter: " + key)
+            object.__setattr__(self, name, hashableValue(value))
+        if values:
+            raise ValueError("Unknown radar parameters: " + str(list(values)))
+        object.__setattr__(self, "derivedCache", {})
+        self.validate()
+
+    @classmethod
+    def fromDict(cls, radar):
+        """
+        This function creates the configuration from a RADAR dict
+        :param radar: dict
+        :return RadarConfig
+        """
+        unknown = set(radar) - set(KEYS)
+        if unknown:
+            raise ValueError("Unknown radar parameters: " + str(list(unknown)))
+        return cls(**{KEYS[key]: value for key, value in radar.items()})
+
+    def toDict(self):
+        """
+        This function returns the configuration as a RADAR dict
+        :return dict
+        """
+        return {key: getattr(self, name) for key, name in KEYS.items()}
+
+    def validate(self):
+        # The counts are checked first, the derived values depend on them
+        for name in ("totalSamples", "totalChirps", "arraySize"):
+            value = getattr(self, name)
+            if not isinstance(value, Integral) or isinstance(value, bool) \
+                or value < 1:
+                raise ValueError(name + " must be a positive integer")
+        if self.totalSamples < 2:
+            raise ValueError("totalSamples must be at least 2")
+        # Check if nyguist criteria is met using the given time samples
+        maxSamplingTime = 1 / (2 * self.chirpBandwidth)
+        if self.sampleTime < maxSamplingTime:
+            raise ValueError("For the given chirp the smallest sampling time is " \
+                + str(maxSamplingTime) + ". Please configure the Chirp correctly")
+        if self.channelCalibration is not None and \
+            len(self.channelCalibration) != self.arraySize:
+            raise ValueError("Channel Calibration needs one value per channel")
+        if self.precision not in PRECISIONS:
+            raise ValueError("Precision must be one of " + str(list(PRECISIONS)))
+        if self.transmitterPositions is not None and \
+            len(self.transmitterPositions) < 1:
+            raise ValueError("Transmitter Positions needs at least one value")
+        if self.receiverPositions is not None and \
+            len(self.receiverPositions) != self.arraySize:
+            raise ValueError("Receiver Positions needs one value per channel")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RadarConfig is immutable")
+
+    def __getitem__(self, key):
+        return getattr(self, KEYS[key])
+
+    def __contains__(self, key):
+        return key in KEYS
+
+    def get(self, key, default=None):
+        value = getattr(self, KEYS[key]) if key in KEYS else None
+        return default if value is None else value
+
+    def values(self):
+        return tuple(getattr(self, name) for name in KEYS.values())
+
+    def __eq__(self, other):
+        return isinstance(other, RadarConfig) and self.values() == other.values()
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __reduce__(self):
+        return (radarConfig, (self.toDict(),))
+
+    def __repr__(self):
+        return "RadarConfig(" + ", ".join(name + "=" + repr(getattr(self, \
+            name)) for name in KEYS.values()) + ")"
+
+    @derived
+    def realType(self):
+        """Type of the real arrays of the configured precision"""
+        return PRECISIONS[self.precision][0]
+
+    @derived
+    def complexType(self):
+        """Type of the complex arrays of the configured precision"""
+        return PRECISIONS[self.precision][1]
+
+    @derived
+    def transmitArray(self):
+        """Position of every transmitter in wavelengths"""
+        if self.transmitterPositions is None:
+            return readOnly(array([0.0]))
+        return readOnly(array(self.transmitterPositions, dtype=float64))
+
+    @derived
+    def receiveArray(self):
+        """Position of every receiver in wavelengths"""
+        if self.receiverPositions is None:
+            return readOnly(self.arraySpacing * arange(self.arraySize, \
+                dtype=float64))
+        return readOnly(array(self.receiverPositions, dtype=float64))
+
+    @derived
+    def virtualArray(self):
+        """Position of every virtual channel, transmitter by transmitter"""
+        return readOnly((self.transmitArray[:, None] + \
+            self.receiveArray[None, :]).ravel())
+
+    @derived
+    def virtualSpacing(self):
+        """Spacing of the virtual channels in wavelengths, None when they are
+        not evenly spaced in channel order"""
+        steps = diff(self.virtualArray)
+        if steps.size == 0:
+            return self.arraySpacing
+        if steps[0] == 0 or not allclose(steps, steps[0]):
+            return None
+        return float(steps[0])
+
+    @derived
+    def totalTransmitters(self):
+        """Transmitters that take turns in the frame"""
+        return self.transmitArray.size
+
+    @derived
+    def virtualSize(self):
+        """Channels of the radar cube"""
+        return self.totalTransmitters * self.arraySize
+
+    @derived
+    def frameChirps(self):
+        """Chirps transmitted in a frame, by all the transmitters"""
+        return self.totalChirps * self.totalTransmitters
+
+    @derived
+    def timeAxis(self):
+        """Time of every sample of a chirp"""
+        return readOnly(linspace(0, self.chirpTime, self.totalSamples))
+
+    @derived
+    def sampleTime(self):
+        """Time between two samples of a chirp"""
+        return self.chirpTime / (self.totalSamples - 1)
+
+    @derived
+    def sampleRate(self):
+        """Samples per second"""
+        return 1 / self.sampleTime
+
+    @derived
+    def chirpSlope(self):
+        """Frequency sweep of the chirp in Hz per second"""
+        return self.chirpBandwidth / self.chirpTime
+
+    @derived
+    def rangeBin(self):
+        """Range covered by one range bin of the radar cube"""
+        return (self.totalSamples - 1) * c / (2 * self.chirpBandwidth * \
+            self.totalSamples)
+
+    @derived
+    def maxRange(self):
+        """Largest unambiguous range"""
+        return self.rangeBin * (self.totalSamples // 2)
+
+    @derived
+    def rangeAxis(self):
+        """Range of every bin of the radar cube, centered on zero"""
+        return readOnly(self.rangeBin * (arange(self.totalSamples) - \
+            self.totalSamples // 2))
+
+    @derived
+    def halfRangeAxis(self):
+        """Range of every bin of the positive range radar cube"""
+        return readOnly(self.rangeBin * arange(self.totalSamples // 2 + 1))
+
+    @derived
+    def dopplerConstant(self):
+        """Doppler phase per chirp of the frame for a velocity of 1 m/s"""
+        return 4 * pi * self.chirpTime / self.carrierWavelength
+
+    @derived
+    def velocityBin(self):
+        """Velocity covered by one doppler bin of the radar cube, the chirps
+        of one transmitter are totalTransmitters chirps apart"""
+        return self.carrierWavelength / (2 * self.frameChirps * self.chirpTime)
+
+    @derived
+    def velocityAxis(self):
+        """Velocity of every doppler bin of the radar cube"""
+        return readOnly(self.velocityBin * (arange(self.totalChirps) - \
+            self.totalChirps // 2))
+
+    @derived
+    def noiseVariance(self):
+        """Scale of the receiver noise"""
+        bandwidth = self.totalSamples / self.chirpTime
+        return k * self.temperature * bandwidth * self.noiseFigure
+
+@lru_cache(maxsize=64)
+def cachedConfig(items):
+    return RadarConfig.fromDict(dict(items))
+
+def radarConfig(radar):
+    """
+    This function returns the RadarConfig of a RADAR dict, the same object
+    for the same values, or the configuration itself
+    :param radar: dict or RadarConfig
+    :return RadarConfig
+    """
+    if isinstance(radar, RadarConfig):
+        return radar
+    return cachedConfig(tuple(sorted((key, hashableValue(value)) \
+        for key, value in radar.items())))
@@ -0,0 +1,182 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Detector Module
+# It finds the targets in a range doppler map with a 2D CFAR (cell averaging,
+# greatest of or ordered statistic) followed by non maximum suppression and a
+# doppler sidelobe floor per range bin. The noise estimate of the cell 
+# averaging detectors uses an integral image so the cost does not depend on
+# the size of the training window.
+
+from numpy import pad, cumsum, zeros, ones, nonzero, argsort, empty, float64, \
+    int32
+from scipy.ndimage import maximum_filter, rank_filter
+from scipy.optimize import brentq
+from instrumentation import instrument
+
+# Compact description of every detection
+DETECTION = [("doppler", int32), ("range", int32), ("power", float64), \
+    ("noise", float64)]
+
+def padMap(powerMap, padDoppler, padRange):
+    """
+    This function pads the power map for the training windows. The doppler 
+    axis wraps around, the range axis is mirrored at the edges.
+    :param powerMap: numpy.array of shape (doppler, range)
+    :param padDoppler: integer
+    :param padRange: integer
+    :return numpy.array
+    """
+    padded = pad(powerMap, ((padDoppler, padDoppler), (0, 0)), mode="wrap")
+    return pad(padded, ((0, 0), (padRange, padRange)), mode="symmetric")
+
+def integralImage(powerMap, padDoppler, padRange):
+    """
+    This function returns the integral image of the padded power map
+    :param powerMap: numpy.array of shape (doppler, range)
+    :param padDoppler: integer
+    :param padRange: integer
+    :return numpy.array
+    """
+    padded = padMap(powerMap, padDoppler, padRange)
+    # A leading row and column of zeros makes every window sum four lookups
+    integral = zeros((padded.shape[0] + 1, padded.shape[1] + 1))
+    cumsum(cumsum(padded, axis=0), axis=1, out=integral[1:, 1:])
+    return integral
+
+def windowSum(integral, shape, padding, doppler, range):
+    """
+    This function returns the sum of the window around every cell of the map
+    :param integral: numpy.array, see integralImage
+    :param shape: tuple, shape of the power map
+    :param padding: tuple, padding of the integral image
+    :param doppler: tuple, first and last doppler offset of the window
+    :param range: tuple, first and last range offset of the window
+    :return numpy.array of the map shape
+    """
+    rowLow = padding[0] + doppler[0]
+    rowHigh = padding[0] + doppler[1] + 1
+    colLow = padding[1] + range[0]
+    colHigh = padding[1] + range[1] + 1
+    return integral[rowHigh:rowHigh + shape[0], colHigh:colHigh + shape[1]] \
+        - integral[rowLow:rowLow + shape[0], colHigh:colHigh + shape[1]] \
+        - integral[rowHigh:rowHigh + shape[0], colLow:colLow + shape[1]] \
+        + integral[rowLow:rowLow + shape[0], colLow:colLow + shape[1]]
+
+def orderedScale(falseAlarmRate, totalCells, rank):
+    """
+    This function solves for the threshold scale of the ordered statistic
+    CFAR that gives the requested false alarm rate
+    :param falseAlarmRate: float
+    :param totalCells: integer, training cells
+    :param rank: integer, 1 based rank of the noise estimate
+    :return float
+    """
+    def error(scale):
+        rate = 1.0
+        for iCell in range(rank):
+            rate *= (totalCells - iCell) / (totalCells - iCell + scale)
+        return rate - falseAlarmRate
+    return brentq(error, 0, 1e6)
+
+def cfar(powerMap, method="CA", guard=(2, 2), training=(4, 8), \
+    falseAlarmRate=1e-6, rank=None):
+    """
+    This function calculates the detection threshold of every cell of a
+    power (square law) range doppler map. The map is not modified.
+    :param powerMap: numpy.array of shape (doppler, range)
+    :param method: string, "CA", "GO" or "OS"
+    :param guard: tuple, guard cells on each side in doppler and range
+    :param training: tuple, training cells on each side in doppler and range,
+        outside the guard cells
+    :param falseAlarmRate: float
+    :param rank: integer, rank of the ordered statistic, 3/4 of the training
+        cells by default
+    :return numpy.array, the threshold, and numpy.array, the noise estimate
+    """
+    outer = (guard[0] + training[0], guard[1] + training[1])
+    totalCells = (2 * outer[0] + 1) * (2 * outer[1] + 1) - \
+        (2 * guard[0] + 1) * (2 * guard[1] + 1)
+
+    if method == "OS":
+        # Footprint of the training cells around the guard cells
+        footprint = ones((2 * outer[0] + 1, 2 * outer[1] + 1), dtype=bool)
+        footprint[training[0]:training[0] + 2 * guard[0] + 1, \
+            training[1]:training[1] + 2 * guard[1] + 1] = False
+        rank = int(0.75 * totalCells) if rank is None else rank
+        noise = rank_filter(padMap(powerMap, outer[0], outer[1]), rank - 1, \
+            footprint=footprint)[outer[0]:outer[0] + powerMap.shape[0], \
+            outer[1]:outer[1] + powerMap.shape[1]]
+        return orderedScale(falseAlarmRate, totalCells, rank) * noise, noise
+
+    integral = integralImage(powerMap, outer[0], outer[1])
+    if method == "CA":
+        # Sum of the outer window minus the guard window
+        noise = windowSum(integral, powerMap.shape, outer, \
+            (-outer[0], outer[0]), (-outer[1], outer[1]))
+        noise -= windowSum(integral, powerMap.shape, outer, \
+            (-guard[0], guard[0]), (-guard[1], guard[1]))
+        noise /= totalCells
+    elif method == "GO":
+        # Greatest of the training cells before and after the cell in range
+        totalCells = (2 * outer[0] + 1) * training[1]
+        leading = windowSum(integral, powerMap.shape, outer, \
+            (-outer[0], outer[0]), (-outer[1], -guard[1] - 1))
+        lagging = windowSum(integral, powerMap.shape, outer, \
+            (-outer[0], outer[0]), (guard[1] + 1, outer[1]))
+        noise = leading
+        noise[lagging > leading] = lagging[lagging > leading]
+        noise /= totalCells
+    else:
+        raise ValueError("Unknown CFAR method: " + str(method))
+
+    # Threshold scale of the square law cell averaging detector
+    scale = totalCells * (falseAlarmRate ** (-1 / totalCells) - 1)
+    return scale * noise, noise
+
+@instrument("detection")
+def detectTargets(powerMap, method="CA", guard=(2, 2), training=(4, 8), \
+    falseAlarmRate=1e-6, rank=None, suppression=(3, 3), sidelobeLevel=60, \
+    maxTargets=None):
+    """
+    This function finds the targets in a power range doppler map. Every cell
+    above the CFAR threshold that is also the largest cell in its suppression
+    window is a detection, so one target gives one detection. The doppler 
+    sidelobes of a strong target reach further than the suppression window,
+    so the cells more than sidelobeLevel below the strongest cell of their
+    range bin are not detections either. The map is not modified.
+    :param powerMap: numpy.array of shape (doppler, range)
+    :param method: string, see cfar
+    :param guard: tuple, see cfar
+    :param training: tuple, see cfar
+    :param falseAlarmRate: float
+    :param rank: integer, see cfar
+    :param suppression: tuple, size of the non maximum suppression window
+    :param sidelobeLevel: float, in dB below the strongest cell of the range
+        bin, None keeps all the peaks
+    :param maxTargets: integer, only keep the strongest detections
+    :return numpy.array of type DETECTION sorted by decreasing power
+    """
+    threshold, noise = cfar(powerMap, method, guard, training, \
+        falseAlarmRate, rank)
+    # Non maximum suppression: keep only the local peaks above the threshold
+    peaks = (powerMap > threshold) & (powerMap == maximum_filter(powerMap, \
+        size=suppression, mode=("wrap", "nearest")))
+    # Sidelobe suppression along doppler, per range bin
+    if sidelobeLevel is not None:
+        peaks &= powerMap >= powerMap.max(axis=0) * 10 ** (-sidelobeLevel / 10)
+    dopplerIndex, rangeIndex = nonzero(peaks)
+
+    # Sorting the detections from the strongest to the weakest
+    order = argsort(powerMap[dopplerIndex, rangeIndex])[::-1][:maxTargets]
+    detections = empty(order.size, dtype=DETECTION)
+    detections["doppler"] = dopplerIndex[order]
+    detections["range"] = rangeIndex[order]
+    detections["power"] = powerMap[dopplerIndex[order], rangeIndex[order]]
+    detections["noise"] = noise[dopplerIndex[order], rangeIndex[order]]
+    return detections
@@ -7,34 +7,45 @@
 # o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
 
 # FMCW Environment Module
-# It is made of one class: RadarTarget() and one function: radarChannel()
+# It is made of one class: RadarTarget() and two functions: radarChannel()
+# and beatChannel(). The functions take the whole scene as a TargetTable (see
+# targets) and synthesize it a chunk of targets at a time.
 # They come with their own test/debug functions that help you visualize the
 # waveforms returned and their frequency spectrums.
 
-from math import pi, sin, radians
+from math import pi
 from scipy.constants import c
-import matplotlib.pyplot as plot
-from numpy import linspace, copy, pad, zeros, abs, exp, multiply
-from common import phaseSpectrum, powerSpectrum, addNoise
+from numpy import linspace, zeros, abs, exp, multiply, arange, \
+    outer, sqrt, minimum, rint, where, matmul, iscomplexobj, concatenate, \
+    array_equal, allclose
+from common import addNoise
 from test_config import RADAR, ENVIRONMENT
-from transmitter import chirpGenerator, sequenceGenerator
+from transmitter import chirpGenerator, sequenceGenerator, transmitSlots
+from estimator import arraySteering
+from configuration import radarConfig
+from instrumentation import instrument
+from targets import targetTable, chunkSize
+from visualization import signalFigure, finishFigure
 
 class RadarTarget():
     """
     RadarTarget class creates a target for the FMCW radar system.
     """
 
-    # The class is initialized with the range of the target
-    # TODO: Add the target velocity as a parameters as well
-    def __init__(self, range, velocity):
+    # The class is initialized with the range and velocity of the target
+    def __init__(self, range, velocity, fractional=False):
         """
         RadarTarget object contructor that requires the range of the target as 
         input
         :param range: integer, must be positive
+        :param velocity: float, positive for an approaching target
+        :param fractional: boolean, use the sub sample delay model including
+            the range migration over the frame (slower)
         """
         # Range and Doppler of the target based on initialization
         self.range = range
         self.velocity = velocity
+        self.fractional = fractional
         # Calculate the delay based on the target distance
         self.delay = (self.range * 2) / c
         # Adding a constant so that the distant targets are still seen
@@ -42,38 +53,84 @@ class RadarTarget():
         # Calculate the attentuation due to propagation
         self.attenuation = powerConstant / (self.range ** 4)
     # The reflection currently only contains range information
-    def reflect(self, radar, chirpSequence):
+    def reflect(self, radar, chirpSequence, noise=True, out=None, \
+        firstChirp=0, seed=None):
         """
         Thus function takes as input an FMCW chirp sequence and returns the 
         sequence with a delay corresponding to the target range
         :param radar: dict
-        :param chirpSequence: numpy.array
+        :param chirpSequence: numpy.array, any whole number of chirps
+        :param noise: boolean, add receiver noise to the echo
+        :param out: numpy.array, optional complex buffer for the echo
+        :param firstChirp: integer, index of the first chirp of the sequence
+            in the frame, for sequences that are a block of the frame
+        :param seed: integer, seed of the noise, see common.noiseGenerator
+        :return numpy.array
         """
-        # Find how many zeros need to be padded in the start
-        time = linspace(0, radar["Chirp Time"], radar["Time Samples in Chirp"])
-        closestIndex = (abs(time - self.delay)).argmin()
-        # Seperating the chirps for individual processing
-        chirpBlock = copy(chirpSequence.astype(complex)).reshape(( \
-            radar["Number of Chirps"], radar["Time Samples in Chirp"]))
-        # Processing chirp by chirp
-        for iSlow in range(radar["Number of Chirps"]):
-            chirpSignal = chirpBlock[iSlow, :]
-            # Pad the zeros and return the chirp signal back after cutting
-            delayChirp = pad(chirpSignal, (closestIndex, 0))
-            delayChirp = delayChirp[0:chirpSignal.size]
-            # Multiple with the constant phase denoting doppler
-            phase = 4 * pi * (iSlow * self.velocity * radar["Chirp Time"]) \
-                / radar["Carrier Wavelength"]
-            phase = exp(1j * phase)
-            # Multiply with the phase and return
-            chirpBlock[iSlow, :] = multiply(phase, delayChirp)
-        
+        radar = radarConfig(radar)
+        totalSamples = radar.totalSamples
+        totalChirps = chirpSequence.size // totalSamples
+        time = radar.timeAxis
+        # Seperating the chirps for processing as a block (no copy is made)
+        chirpBlock = chirpSequence.reshape((totalChirps, totalSamples))
+        if out is None:
+            out = zeros(totalChirps * totalSamples, dtype=radar.complexType)
+        echoBlock = out.reshape((totalChirps, totalSamples))
+        # Constant phase per chirp denoting doppler, scaled by the attenuation
+        chirpIndex = firstChirp + arange(totalChirps)
+        phase = radar.dopplerConstant * self.velocity * chirpIndex
+        phase = self.attenuation * exp(1j * phase)
+        if self.fractional:
+            # Delay every chirp by its own (sub sample) delay in frequency
+            echoBlock[:] = self.fractionalDelay(radar, chirpBlock, \
+                chirpIndex)
+            echoBlock *= phase[:, None]
+        else:
+            # Find how many zeros need to be padded in the start
+            closestIndex = (abs(time - self.delay)).argmin()
+            # Delay all the chirps at once and multiply with the phase
+            echoBlock[:, :closestIndex] = 0
+            multiply(chirpBlock[:, :totalSamples - closestIndex], \
+                phase[:, None], out=echoBlock[:, closestIndex:])
+
         # Add noise to the returned signal
-        chirpBlock = addNoise(radar, chirpBlock)
+        if noise:
+            addNoise(radar, out.reshape((1, -1)), self.attenuation, seed, \
+                firstChirp=firstChirp)
 
         # Return the sequence back to the receiver
-        return self.attenuation * chirpBlock.flatten()
-        # return chirpBlock.flatten()
+        return out
+
+    def fractionalDelay(self, radar, chirpBlock, chirpIndex):
+        """
+        This function delays every chirp of the block by the round trip time
+        of the target at that chirp, which changes over the frame as the 
+        target moves. The chirp of chirpGenerator is evaluated at the delayed
+        sample times, so the delay does not have to be a multiple of the 
+        sample time even though the sampled chirp is aliased. The carrier
+        phase of the range migration is the doppler phase of the chirps, see
+        reflect and arraySignal.
+        :param radar: RadarConfig
+        :param chirpBlock: numpy.array of shape (chirps, samples), every
+            chirp must be the chirp of chirpGenerator
+        :param chirpIndex: numpy.array, index of every chirp in the frame
+        :return numpy.array of shape (chirps, samples)
+        """
+        # The chirp is evaluated in closed form instead of delaying the 
+        # block, so any other waveform would be silently replaced. A 
+        # sequence that repeats one chirp is checked once.
+        chirps = chirpBlock[:1] if chirpBlock.strides[0] == 0 else chirpBlock
+        if not (chirps == chirpGenerator(radar, False)).all():
+            raise ValueError("The fractional delay model only delays the " \
+                "chirp of chirpGenerator")
+        # Range of the target at the start of every chirp
+        chirpRange = self.range - self.velocity * radar.chirpTime * chirpIndex
+        delays = (chirpRange * 2) / c
+        # Time since the echo of every chirp arrived, zero before it arrives
+        delayedTime = radar.timeAxis[None, :] - delays[:, None]
+        echo = exp(-1j * pi * radar.chirpSlope * delayedTime * delayedTime)
+        echo[delayedTime < 0] = 0
+        return echo if iscomplexobj(chirpBlock) else echo.real
 
 def test_radarTarget():
     # Generate the time axis for plotting the signal
@@ -100,62 +157,148 @@ def test_radarTarget():
     receiveSequence = target.reflect(RADAR, transmitSequence)
 
     # Plotting the received signal to check for delay
-    fig = plot.figure()
     title = "Receive Chirp (Single Target at" + str(targetDistance) + "m)"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    timePlot = plot.subplot(211)
-    timePlot.plot(time, receiveSequence)
-    timePlot.title.set_text('Time Domain')
-    timePlot.grid()
-
-    frequencyPlot = plot.subplot(223)
-    frequencyPlot.plot(frequency / 1e6, powerSpectrum(receiveSequence))
-    frequencyPlot.title.set_text('Frequency Domain: Amplitude')
-    frequencyPlot.grid()
+    finishFigure(signalFigure(title, time, receiveSequence, frequency))
 
-    anglePlot = plot.subplot(224)
-    anglePlot.plot(frequency / 1e6, phaseSpectrum(receiveSequence))
-    anglePlot.title.set_text('Frequency Domain: Phase')
-    anglePlot.grid()
-
-    plot.show()
+def arraySignal(radar, targets, chirpIndex):
+    """
+    This function returns the phase of every target on every channel (its
+    angle) and chirp (its velocity and, for a MIMO radar, the position of 
+    the transmitter of the chirp), scaled by its attenuation
+    :param radar: RadarConfig
+    :param targets: targets.TargetTable
+    :param chirpIndex: numpy.array, index of every chirp in the frame
+    :return numpy.array of shape (channels, chirps, targets)
+    """
+    chirpSignal = targets.attenuation * exp(1j * radar.dopplerConstant * \
+        outer(chirpIndex, targets.velocity))
+    if radar.totalTransmitters > 1:
+        chirpSignal *= arraySteering(radar.transmitArray, targets.angle)[ \
+            transmitSlots(radar, chirpIndex)]
+    return (arraySteering(radar.receiveArray, targets.angle)[:, None, :] * \
+        chirpSignal[None, :, :]).astype(radar.complexType)
 
-def radarChannel(radar, environment, chirpSequence):
+@instrument("channel")
+def radarChannel(radar, environment, chirpSequence, firstChirp=0, \
+    seed=None, frame=0, noiseBuffer=None, chunkTargets=None):
     """
-    This function creates a list of targets based on the environment and the 
-    radar sensor and reflects the chirp sequence
+    This function reflects the chirp sequence off all the targets of the
+    scene and returns the received signal of every channel. The targets are
+    processed in chunks so the intermediate arrays stay small.
     :param radar: dict
-    :param environment: dict
+    :param environment: dict, targets.TargetTable or a CSV or NPZ file name
     :param chirpSequence: numpy.array
-    :return numpy.array
+    :param firstChirp: integer, see RadarTarget.reflect
+    :param seed: integer, seed of the noise, see common.noiseGenerator
+    :param frame: integer, index of the frame for the noise
+    :param noiseBuffer: numpy.array, optional buffer for the noise of the
+        shape of the returned sequence
+    :param chunkTargets: integer, targets per chunk, see targets.chunkSize
+    :return numpy.array of shape (channels, samples)
     """
+    radar = radarConfig(radar)
+    targets = targetTable(environment)
+    totalSamples = radar.totalSamples
+    chirpBlock = chirpSequence.reshape((-1, totalSamples))
+    totalChirps = chirpBlock.shape[0]
+    chirpIndex = firstChirp + arange(totalChirps)
+    receivedCube = zeros((radar.arraySize, totalChirps, totalSamples), \
+        dtype=radar.complexType)
+
+    # A sequence that repeats one chirp (see sequenceGenerator) has the same
+    # delayed chirp for every chirp of a target
+    repeated = chirpBlock.strides[0] == 0
+    bytesPerTarget = receivedCube.itemsize * (radar.arraySize * totalChirps + \
+        totalSamples * (1 if repeated else totalChirps))
+
+    for chunk in targets.chunks(chunkTargets or chunkSize(bytesPerTarget)):
+        chunkSignal = arraySignal(radar, chunk, chirpIndex)
+        if targets.fractional:
+            # Every chirp of every target is delayed on its own
+            for iTarget in range(len(chunk)):
+                echo = RadarTarget(chunk.range[iTarget], \
+                    chunk.velocity[iTarget], True).fractionalDelay(radar, \
+                    chirpBlock, chirpIndex)
+                receivedCube += chunkSignal[:, :, iTarget, None] * echo
+            continue
+
+        # Delay of every target to the closest sample, the echo is zero 
+        # until it arrives
+        delaySamples = minimum(rint(chunk.delay / radar.sampleTime), \
+            totalSamples - 1).astype(int)
+        sampleIndex = arange(totalSamples) - delaySamples[:, None]
+        arrived = sampleIndex >= 0
+        sampleIndex[~arrived] = 0
+        if repeated:
+            # One product over the targets for all the channels and chirps
+            delayedChirps = where(arrived, chirpBlock[0][sampleIndex], 0) \
+                .astype(radar.complexType)
+            receivedCube += (chunkSignal.reshape((-1, len(chunk))) @ \
+                delayedChirps).reshape(receivedCube.shape)
+        else:
+            # One product over the targets per chirp
+            delayedChirps = where(arrived, chirpBlock[:, sampleIndex], 0) \
+                .astype(radar.complexType)
+            receivedCube += matmul(chunkSignal.transpose((1, 0, 2)), \
+                delayedChirps).transpose((1, 0, 2))
+
+    # Noise is added once per channel with the power of the per target noise
+    receivedSequence = receivedCube.reshape((radar.arraySize, -1))
+    addNoise(radar, receivedSequence, sqrt((targets.attenuation ** 2).sum()), \
+        seed, frame, firstChirp, noiseBuffer)
 
-    # Creating an empty array where the return sequence is stored
-    receivedSequence = zeros((radar["Array Size"], chirpSequence.size), \
-        dtype=complex)
-
-    # Loop through the channels
-    for iChannel in range(radar["Array Size"]):
-        # Creating the targets based on the class radarTarget
-        for iTarget in range(environment["Total Targets"]):
-            # Storing the target properties for easy access
-            targetDistance = environment["Target " + str(iTarget + 1)][0]
-            targetVelocity = environment["Target " + str(iTarget + 1)][1]
-            targetAngle = environment["Target " + str(iTarget + 1)][2]
-            # Calculating the phase difference due to array geometry
-            arrayPhase = 2 * pi * radar["Array Spacing"] * iChannel * \
-                sin(radians(targetAngle))
-            arrayFactor = exp(1j * arrayPhase)
-            # Calculate the target reflection and multiply array phase factor
-            target = RadarTarget(targetDistance, targetVelocity)
-            targetResponse = arrayFactor * target.reflect(radar, chirpSequence)
-            # Store in the received sequence array
-            receivedSequence[iChannel, :] = receivedSequence[iChannel, :] + \
-                targetResponse
     # Return back the sequence to the Receiver
     return receivedSequence
 
+@instrument("channel")
+def beatChannel(radar, environment, firstChirp=0, totalChirps=None, \
+    seed=None, frame=0, noiseBuffer=None, chunkTargets=None):
+    """
+    This function calculates the mixer output (beat signal) of every channel
+    directly in closed form instead of reflecting and mixing the chirps. Each 
+    target adds a complex sinusoid at the beat frequency of its range, with a
+    phase that steps from chirp to chirp with its velocity and from channel 
+    to channel with its angle.
+    :param radar: dict
+    :param environment: dict, targets.TargetTable or a CSV or NPZ file name
+    :param firstChirp: integer, index of the first chirp in the frame
+    :param totalChirps: integer, chirps to calculate, the whole frame by 
+        default
+    :param seed: integer, seed of the noise, see common.noiseGenerator
+    :param frame: integer, index of the frame for the noise
+    :param noiseBuffer: numpy.array, optional buffer for the noise of the
+        shape of the returned cube
+    :param chunkTargets: integer, targets per chunk, see targets.chunkSize
+    :return numpy.array of shape (channels, chirps, samples)
+    """
+    radar = radarConfig(radar)
+    targets = targetTable(environment)
+    if totalChirps is None:
+        totalChirps = radar.frameChirps - firstChirp
+    chirpSlope = radar.chirpSlope
+    time = radar.timeAxis
+    chirpIndex = firstChirp + arange(totalChirps)
+    beatCube = zeros((radar.arraySize, totalChirps, radar.totalSamples), \
+        dtype=radar.complexType)
+    bytesPerTarget = beatCube.itemsize * (radar.arraySize * totalChirps + \
+        radar.totalSamples)
+
+    for chunk in targets.chunks(chunkTargets or chunkSize(bytesPerTarget)):
+        delay = chunk.delay
+        # Fast time: beat frequency and residual phase of the delayed chirp.
+        # The phases are always calculated in double precision, only the 
+        # signals are stored in the precision of the radar.
+        rangeSignal = exp(1j * pi * chirpSlope * \
+            (2 * outer(delay, time) - (delay ** 2)[:, None])) \
+            .astype(radar.complexType)
+        # Sum the targets of the chunk with one product over the target axis
+        beatCube += (arraySignal(radar, chunk, chirpIndex).reshape((-1, \
+            len(chunk))) @ rangeSignal).reshape(beatCube.shape)
+
+    # Noise is added once per channel with the power of the per target noise
+    return addNoise(radar, beatCube, sqrt((targets.attenuation ** 2).sum()), \
+        seed, frame, firstChirp, noiseBuffer)
+
 def test_radarChannel():
     # Generate the time axis for plotting the signal
     time = linspace(0, RADAR["Chirp Time"] * RADAR["Number of Chirps"], \
@@ -177,30 +320,35 @@ def test_radarChannel():
     channelSequence = receiveSequence[0, :]
 
     # Plotting the received signal to check for delay
-    fig = plot.figure()
     title = "Receive Chirp (Targets at: " + str(ENVIRONMENT["Target 1"][0]) + \
         "m and " + str(ENVIRONMENT["Target 2"][0]) + "m)"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    timePlot = plot.subplot(211)
-    timePlot.plot(time, abs(channelSequence.real))
-    timePlot.title.set_text('Time Domain')
-    timePlot.grid()
-
-    frequencyPlot = plot.subplot(223)
-    frequencyPlot.plot(frequency / 1e6, powerSpectrum(channelSequence))
-    frequencyPlot.title.set_text('Frequency Domain: Amplitude')
-    frequencyPlot.grid()
+    finishFigure(signalFigure(title, time, abs(channelSequence.real), \
+        frequency, channelSequence))
 
-    anglePlot = plot.subplot(224)
-    anglePlot.plot(frequency / 1e6, phaseSpectrum(channelSequence))
-    anglePlot.title.set_text('Frequency Domain: Phase')
-    anglePlot.grid()
+def test_chunkedChannel():
+    # The same seed gives the same frame on every run
+    transmitSequence = sequenceGenerator(RADAR, chirpGenerator(RADAR, False), \
+        False)
+    frame = radarChannel(RADAR, ENVIRONMENT, transmitSequence, seed=0)
+    assert array_equal(frame, radarChannel(RADAR, ENVIRONMENT, \
+        transmitSequence, seed=0))
 
-    plot.show()
+    # Blocks of chirps with their first chirp give the frame of one call,
+    # noise included
+    radar = radarConfig(RADAR)
+    blockChirps = 4 * radar.totalTransmitters
+    blocks = [radarChannel(RADAR, ENVIRONMENT, transmitSequence[firstChirp: \
+        firstChirp + blockChirps], firstChirp, seed=0) for firstChirp in \
+        range(0, radar.frameChirps, blockChirps)]
+    chunkedFrame = concatenate(blocks, axis=1)
+    print("Chunked frame error: {:.2e}".format(abs(chunkedFrame - \
+        frame).max()))
+    assert allclose(chunkedFrame, frame, rtol=0, atol=1e-6 * \
+        abs(frame).max())
 
 # Run this file to test the functions by examining the time and frequency 
 # domain representations of the received chirp sequence
 if __name__ == '__main__':
     test_radarTarget()
-    test_radarChannel()
\ No newline at end of file
+    test_radarChannel()
+    test_chunkedChannel()
@@ -0,0 +1,304 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Angle Estimator Module
+# It estimates the angle of arrival from the snapshots of the array channels,
+# either with a zero padded FFT across the array or with a Bartlett
+# beamformer over a precomputed grid of steering vectors. For targets closer
+# than the beamwidth the MUSIC and Capon estimators use the covariance of the
+# snapshots of the neighbouring doppler bins. All the cells are processed 
+# together. The channels are the virtual channels of a MIMO radar, see
+# configuration.
+
+from math import pi
+from functools import lru_cache
+from numpy import arange, outer, exp, sin, deg2rad, rad2deg, arcsin, clip, \
+    argmax, abs, asarray, empty, eye, argsort, inf, full, indices, concatenate
+from numpy.linalg import eigh
+from numpy.fft import fft
+from configuration import radarConfig
+from instrumentation import instrument
+
+def arraySteering(positions, angles):
+    """
+    This function calculates the phase factor seen by every element of an
+    array for every angle, as one outer product of the positions and the 
+    sines of the angles
+    :param positions: numpy.array, element positions in wavelengths
+    :param angles: numpy.array, angles in degrees
+    :return numpy.array of shape (elements, angles)
+    """
+    return exp(2j * pi * outer(positions, sin(deg2rad(angles))))
+
+def steeringMatrix(radar, angles):
+    """
+    This function calculates the phase factor seen by every channel of the
+    radar cube (every virtual channel of a MIMO radar) for every target angle
+    :param radar: dict
+    :param angles: numpy.array, target angles in degrees
+    :return numpy.array of shape (channels, targets)
+    """
+    return arraySteering(radarConfig(radar).virtualArray, angles)
+
+@lru_cache(maxsize=16)
+def cachedSteeringGrid(positions, resolution):
+    angles = arange(-90, 90 + resolution, resolution)
+    steering = arraySteering(positions, angles)
+    angles.flags.writeable = False
+    steering.flags.writeable = False
+    return angles, steering
+
+def steeringGrid(radar, resolution=0.5):
+    """
+    This function returns a grid of angles from -90 to 90 degrees and the 
+    steering vectors of the array for them. It is calculated once per array.
+    :param radar: dict
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of angles, numpy.array of shape (channels, angles)
+    """
+    return cachedSteeringGrid(tuple(radarConfig(radar).virtualArray.tolist()), \
+        resolution)
+
+def fftAngles(radar, snapShots, padding=64):
+    """
+    This function estimates the angle of every snapshot from the peak of the
+    zero padded FFT across the (virtual) array. The FFT needs evenly spaced
+    channels, the angles of any other array are the Bartlett ones.
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels)
+    :param padding: integer, FFT length
+    :return numpy.array of angles in degrees
+    """
+    spacing = radarConfig(radar).virtualSpacing
+    if spacing is None:
+        return bartlettAngles(radar, snapShots)
+    spectrum = abs(fft(snapShots, n=padding, axis=-1))
+    # Spatial frequency of the peak in the range [-0.5, 0.5) cycles per channel
+    peak = (argmax(spectrum, axis=-1) + padding // 2) % padding - padding // 2
+    sine = clip(peak / (padding * spacing), -1, 1)
+    return rad2deg(arcsin(sine))
+
+def bartlettSpectrum(radar, snapShots, resolution=0.5):
+    """
+    This function calculates the power of the Bartlett beamformer of every 
+    snapshot over the steering grid with one matrix product
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels)
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of angles, numpy.array of shape (cells, angles)
+    """
+    angles, steering = steeringGrid(radar, resolution)
+    return angles, abs(snapShots @ steering.conj()) ** 2
+
+def bartlettAngles(radar, snapShots, resolution=0.5):
+    """
+    This function estimates the angle of every snapshot from the peak of the 
+    Bartlett beamformer
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels)
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of angles in degrees
+    """
+    angles, power = bartlettSpectrum(radar, snapShots, resolution)
+    return angles[argmax(power, axis=-1)]
+
+def covarianceMatrix(snapShots, forwardBackward=True):
+    """
+    This function calculates the spatial covariance matrix of every cell from
+    its snapshots
+    :param snapShots: numpy.array of shape (cells, channels, snapshots)
+    :param forwardBackward: boolean, average with the reversed conjugate array
+        which decorrelates targets with the same doppler, see forwardBackward
+    :return numpy.array of shape (cells, channels, channels)
+    """
+    covariance = snapShots @ snapShots.conj().swapaxes(-1, -2)
+    covariance /= snapShots.shape[-1]
+    if forwardBackward:
+        covariance = 0.5 * (covariance + covariance[:, ::-1, ::-1].conj())
+    return covariance
+
+def forwardBackward(radar):
+    """
+    This function tells if the forward backward average applies to the 
+    (virtual) array: the reversed array has to be the same array, which is
+    the case for evenly spaced channels
+    :param radar: dict
+    :return boolean
+    """
+    return radarConfig(radar).virtualSpacing is not None
+
+def subspaceProjection(steering, eigenVectors, weights):
+    """
+    This function calculates the weighted power of the steering vectors
+    projected on the eigenvectors of every cell
+    :param steering: numpy.array of shape (channels, angles)
+    :param eigenVectors: numpy.array of shape (cells, channels, vectors)
+    :param weights: numpy.array of shape (cells, vectors)
+    :return numpy.array of shape (cells, angles)
+    """
+    projection = abs(eigenVectors.conj().swapaxes(-1, -2) @ steering) ** 2
+    return (weights[:, :, None] * projection).sum(axis=1)
+
+def musicSpectrum(radar, snapShots, sources=1, resolution=0.5):
+    """
+    This function calculates the MUSIC pseudo spectrum of every cell. All the
+    covariance matrices are decomposed together.
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels, snapshots)
+    :param sources: integer, targets per cell
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of angles, numpy.array of shape (cells, angles)
+    """
+    angles, steering = steeringGrid(radar, resolution)
+    # Eigenvalues are ascending, the first ones span the noise subspace
+    eigenVectors = eigh(covarianceMatrix(snapShots, \
+        forwardBackward(radar)))[1]
+    noiseVectors = eigenVectors[:, :, :eigenVectors.shape[-1] - sources]
+    weights = full(noiseVectors.shape[::2], 1.0)
+    return angles, 1 / subspaceProjection(steering, noiseVectors, weights)
+
+def caponSpectrum(radar, snapShots, resolution=0.5, loading=1e-3):
+    """
+    This function calculates the Capon (MVDR) spectrum of every cell. The 
+    inverse covariance comes from the same batched eigendecomposition.
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels, snapshots)
+    :param resolution: float, grid spacing in degrees
+    :param loading: float, diagonal loading relative to the average power
+    :return numpy.array of angles, numpy.array of shape (cells, angles)
+    """
+    angles, steering = steeringGrid(radar, resolution)
+    covariance = covarianceMatrix(snapShots, forwardBackward(radar))
+    # Diagonal loading keeps the inverse stable with few snapshots
+    power = covariance.trace(axis1=-2, axis2=-1).real / covariance.shape[-1]
+    covariance += (loading * power)[:, None, None] * eye(covariance.shape[-1])
+    eigenValues, eigenVectors = eigh(covariance)
+    return angles, 1 / subspaceProjection(steering, eigenVectors, \
+        1 / eigenValues)
+
+def spectrumPeaks(angles, spectrum, sources=1):
+    """
+    This function returns the angles of the largest peaks of every spectrum
+    :param angles: numpy.array
+    :param spectrum: numpy.array of shape (cells, angles)
+    :param sources: integer, peaks per cell
+    :return numpy.array of shape (cells,) or (cells, sources)
+    """
+    if sources == 1:
+        return angles[argmax(spectrum, axis=-1)]
+    # Only the local maxima are candidates for the peaks
+    peaks = full(spectrum.shape, -inf)
+    local = (spectrum[:, 1:-1] > spectrum[:, :-2]) & \
+        (spectrum[:, 1:-1] >= spectrum[:, 2:])
+    peaks[:, 1:-1][local] = spectrum[:, 1:-1][local]
+    order = argsort(peaks, axis=-1)[:, ::-1][:, :sources]
+    # Sorting the peaks of every cell by angle
+    peakAngles = angles[order]
+    peakAngles.sort(axis=-1)
+    return peakAngles
+
+def musicAngles(radar, snapShots, sources=1, resolution=0.5):
+    """
+    This function estimates the angles of the targets of every cell from the
+    peaks of the MUSIC pseudo spectrum
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels, snapshots)
+    :param sources: integer, targets per cell
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of shape (cells,) or (cells, sources)
+    """
+    angles, spectrum = musicSpectrum(radar, snapShots, sources, resolution)
+    return spectrumPeaks(angles, spectrum, sources)
+
+def caponAngles(radar, snapShots, sources=1, resolution=0.5):
+    """
+    This function estimates the angles of the targets of every cell from the
+    peaks of the Capon spectrum
+    :param radar: dict
+    :param snapShots: numpy.array of shape (cells, channels, snapshots)
+    :param sources: integer, targets per cell
+    :param resolution: float, grid spacing in degrees
+    :return numpy.array of shape (cells,) or (cells, sources)
+    """
+    angles, spectrum = caponSpectrum(radar, snapShots, resolution)
+    return spectrumPeaks(angles, spectrum, sources)
+
+# Angle estimators by name, the covariance ones need neighbouring snapshots
+ESTIMATORS = {"FFT": fftAngles, "Bartlett": bartlettAngles}
+COVARIANCE_ESTIMATORS = {"MUSIC": musicAngles, "Capon": caponAngles}
+
+def cellIndices(cells):
+    """
+    This function returns the doppler and range indices of the given cells
+    :param cells: numpy.array of type detector.DETECTION or a list of
+        (doppler, range) indices
+    :return numpy.array, numpy.array
+    """
+    if getattr(cells, "dtype", None) is not None and cells.dtype.names:
+        return cells["doppler"], cells["range"]
+    cells = asarray(cells, dtype=int).reshape((-1, 2))
+    return cells[:, 0], cells[:, 1]
+
+def gatherSnapShots(radarCube, dopplerIndex, rangeIndex, neighbours=0):
+    """
+    This function gathers the array snapshots of the given cells of the cube
+    :param radarCube: numpy.array of shape (channels, doppler, range)
+    :param dopplerIndex: numpy.array
+    :param rangeIndex: numpy.array
+    :param neighbours: integer, doppler bins on each side used as additional
+        snapshots of the same cell
+    :return numpy.array of shape (cells, channels) or, with neighbours, of 
+        shape (cells, channels, snapshots)
+    """
+    if neighbours == 0:
+        return radarCube[:, dopplerIndex, rangeIndex].T
+    # The doppler axis wraps around
+    dopplerBins = (dopplerIndex[:, None] + arange(-neighbours, \
+        neighbours + 1)) % radarCube.shape[1]
+    return radarCube[:, dopplerBins, rangeIndex[:, None]].transpose(1, 0, 2)
+
+@instrument("angle")
+def estimateAngles(radar, radarCube, cells=None, method="FFT", chunk=8192, \
+    neighbours=2, sources=1):
+    """
+    This function estimates the angle of the given cells of the radar cube,
+    or of every cell when no cells are given
+    :param radar: dict
+    :param radarCube: numpy.array of shape (channels, doppler, range)
+    :param cells: see cellIndices
+    :param method: string, "FFT", "Bartlett", "MUSIC" or "Capon"
+    :param chunk: integer, cells processed together
+    :param neighbours: integer, see gatherSnapShots, MUSIC and Capon only
+    :param sources: integer, targets per cell, MUSIC and Capon only
+    :return numpy.array of angles, one per cell or of shape (doppler, range),
+        with an additional axis for more than one source
+    """
+    if cells is None:
+        cellShape = radarCube.shape[1:]
+        dopplerIndex, rangeIndex = indices(cellShape).reshape((2, -1))
+    else:
+        dopplerIndex, rangeIndex = cellIndices(cells)
+        cellShape = dopplerIndex.shape
+
+    # The cells are processed in chunks to bound the memory
+    angles = []
+    for iCell in range(0, dopplerIndex.size, chunk):
+        cellSlice = slice(iCell, iCell + chunk)
+        if method in COVARIANCE_ESTIMATORS:
+            snapShots = gatherSnapShots(radarCube, dopplerIndex[cellSlice], \
+                rangeIndex[cellSlice], neighbours)
+            angles.append(COVARIANCE_ESTIMATORS[method](radar, snapShots, \
+                sources))
+        else:
+            snapShots = gatherSnapShots(radarCube, dopplerIndex[cellSlice], \
+                rangeIndex[cellSlice])
+            angles.append(ESTIMATORS[method](radar, snapShots))
+    if not angles:
+        return empty(cellShape)
+    angles = concatenate(angles)
+    return angles.reshape(tuple(cellShape) + angles.shape[1:])
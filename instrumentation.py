@@ -0,0 +1,243 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Instrumentation Module
+# Optional records of the stages of the processing chain (transmit, channel,
+# mix, range FFT, doppler FFT, detection, angle): wall time, bytes and shapes
+# of the returned arrays and the frame they belong to. The records are sent
+# to the sinks that have been added. Without sinks an instrumented stage only
+# checks that the list of sinks is empty.
+
+import json
+from time import perf_counter, time
+from collections import deque
+from functools import wraps
+
+# Sinks the records are sent to, the instrumentation is off when it is empty
+sinks = []
+# Frame the records are tagged with
+state = {"frame": None}
+
+def addSink(sink):
+    """
+    This function starts sending the records to a sink
+    :param sink: object with a write(record) method
+    :return the sink
+    """
+    sinks.append(sink)
+    return sink
+
+def removeSink(sink):
+    sinks.remove(sink)
+
+def setFrame(frame):
+    """
+    This function sets the frame (or scenario) the next records belong to
+    :param frame: integer or None
+    """
+    state["frame"] = frame
+
+def arrayBytes(array):
+    """
+    This function returns the memory held by an array. Views of a part of a
+    larger array (slices, broadcasts, memory maps) count as zero bytes, a
+    view of a whole array (e.g. a reshape) as the bytes of that array.
+    :param array: numpy.array
+    :return integer
+    """
+    base = array
+    while hasattr(base.base, "nbytes"):
+        base = base.base
+    return array.nbytes if base.nbytes == array.nbytes and \
+        base.flags.owndata else 0
+
+def arraySummary(output):
+    """
+    This function returns the bytes and the shapes of the arrays returned by
+    a stage, see arrayBytes
+    :param output: numpy.array, tuple or list of them, or anything else
+    :return integer, list of list
+    """
+    arrays = output if isinstance(output, (tuple, list)) else (output,)
+    arrays = [array for array in arrays if hasattr(array, "flags")]
+    return sum(arrayBytes(array) for array in arrays), \
+        [list(array.shape) for array in arrays]
+
+def emit(stage, function, start, output, frame=None):
+    """
+    This function sends the record of one call of a stage to every sink
+    :param stage: string
+    :param function: string, name of the function of the stage
+    :param start: float, perf_counter at the start of the call
+    :param output: the returned value
+    :param frame: integer, the current frame by default
+    """
+    seconds = perf_counter() - start
+    outputBytes, shapes = arraySummary(output)
+    record = {"time": time(), "stage": stage, "function": function, \
+        "frame": state["frame"] if frame is None else frame, \
+        "seconds": seconds, "outputBytes": outputBytes, "shapes": shapes}
+    for sink in sinks:
+        sink.write(record)
+
+def event(stage, **values):
+    """
+    This function sends a record with values (e.g. parameters) to the sinks
+    :param stage: string
+    :param values: values of the record
+    """
+    if sinks:
+        record = dict(values, time=time(), stage=stage, frame=state["frame"])
+        for sink in sinks:
+            sink.write(record)
+
+def instrument(stage):
+    """
+    This decorator records every call of a function as a call of the stage
+    :param stage: string
+    :return decorator
+    """
+    def decorator(function):
+        name = function.__qualname__
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not sinks:
+                return function(*args, **kwargs)
+            start = perf_counter()
+            output = function(*args, **kwargs)
+            emit(stage, name, start, output)
+            return output
+        return wrapper
+    return decorator
+
+class StageTimer():
+    """
+    StageTimer class records a block of code as a call of a stage, the value
+    of the block is given to it with done(output)
+    """
+
+    __slots__ = ("stage", "function", "frame", "start", "output")
+
+    def __init__(self, stage, function, frame=None):
+        self.stage = stage
+        self.function = function
+        self.frame = frame
+        self.start = None
+        self.output = None
+
+    def __enter__(self):
+        if sinks:
+            self.start = perf_counter()
+        return self
+
+    def done(self, output):
+        self.output = output
+        return output
+
+    def __exit__(self, *exception):
+        if sinks and self.start is not None:
+            emit(self.stage, self.function, self.start, self.output, \
+                self.frame)
+
+class RingBufferSink():
+    """
+    RingBufferSink class keeps the latest records in memory.
+    """
+
+    def __init__(self, size=4096):
+        self.buffer = deque(maxlen=size)
+
+    def write(self, record):
+        self.buffer.append(record)
+
+    def records(self, stage=None):
+        """
+        This function returns the records in the buffer, oldest first
+        :param stage: string, only the records of this stage
+        :return list of dict
+        """
+        return [record for record in self.buffer \
+            if stage is None or record["stage"] == stage]
+
+    def clear(self):
+        self.buffer.clear()
+
+class JsonLinesSink():
+    """
+    JsonLinesSink class appends every record as one line of json to a file.
+    """
+
+    def __init__(self, fileName):
+        # Line buffered so the records are in the file when the line ends
+        self.file = open(fileName, "a", buffering=1)
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class PrometheusSink():
+    """
+    PrometheusSink class sums the records of every stage and writes them in
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self, prefix="fmcw"):
+        self.prefix = prefix
+        self.totals = {}
+
+    def write(self, record):
+        # Events carry no timing
+        if "seconds" not in record:
+            return
+        key = (record["stage"], record["function"])
+        total = self.totals.setdefault(key, [0, 0.0, 0])
+        total[0] += 1
+        total[1] += record["seconds"]
+        total[2] += record["outputBytes"]
+
+    def exposition(self):
+        """
+        This function returns the totals in the Prometheus text format
+        :return string
+        """
+        metrics = [("stage_seconds", "summary", "Wall time of the stage", \
+            (("_sum", 1), ("_count", 0))), ("stage_output_bytes", "counter", \
+            "Bytes of the arrays returned by the stage", (("_total", 2),))]
+        lines = []
+        for name, kind, description, series in metrics:
+            lines.append("# HELP " + self.prefix + "_" + name + " " + \
+                description)
+            lines.append("# TYPE " + self.prefix + "_" + name + " " + kind)
+            for (stage, function), total in sorted(self.totals.items()):
+                labels = '{stage="' + stage + '",function="' + function + '"}'
+                for suffix, iTotal in series:
+                    lines.append(self.prefix + "_" + name + suffix + labels + \
+                        " " + repr(total[iTotal]))
+        return "\n".join(lines) + "\n"
+
+    def writeExposition(self, fileName):
+        """
+        This function writes the totals to a file, e.g. for the textfile
+        collector of the node exporter
+        :param fileName: string
+        """
+        with open(fileName, "w") as file:
+            file.write(self.exposition())
+
+class PrintSink():
+    """
+    PrintSink class prints every record on one line.
+    """
+
+    def write(self, record):
+        values = ", ".join(key + ": " + (format(value, ".2e") if \
+            isinstance(value, float) else str(value)) for key, value in \
+            record.items() if key not in ("time", "stage"))
+        print(record["stage"] + " - " + values)
@@ -0,0 +1,128 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Integration Module
+# It combines the channels of a radar cube into the one map the detector
+# works on: the square law (power) range doppler map, linear, of shape
+# (doppler, range). The channels are integrated non coherently (the mean of
+# their power), coherently along one steered beam, or as the largest beam of
+# a fan. The power is summed channel by channel or beam by beam into the map,
+# so the cube of magnitudes is never allocated. The beams are formed on 
+# chunks of cells to bound the memory. The map can be converted to dB for
+# display, the detector needs it linear.
+
+from functools import lru_cache
+from numpy import empty, log10, arcsin, rad2deg, linspace, abs, add, \
+    maximum, conj
+from estimator import steeringMatrix
+from configuration import radarConfig
+from instrumentation import instrument
+
+MODES = ("Noncoherent", "Coherent", "Max Beam")
+
+@lru_cache(maxsize=16)
+def beamWeights(radar, angles, complexType):
+    """
+    This function returns the weights that form a beam in every direction,
+    scaled so the noise power of a beam is the noise power of a channel
+    :param radar: RadarConfig
+    :param angles: tuple, beam angles in degrees
+    :param complexType: numpy.dtype
+    :return numpy.array of shape (beams, channels)
+    """
+    weights = (conj(steeringMatrix(radar, list(angles))).T / \
+        radar.virtualSize ** 0.5).astype(complexType)
+    weights.flags.writeable = False
+    return weights
+
+def beamAngles(radar, beams=None):
+    """
+    This function returns a fan of beams evenly spaced in sine of the angle,
+    two beams per channel by default so neighbouring beams cross at about
+    -1dB
+    :param radar: dict
+    :param beams: integer
+    :return tuple of angles in degrees
+    """
+    radar = radarConfig(radar)
+    beams = 2 * radar.virtualSize if beams is None else beams
+    # The fan stays inside the unambiguous field of view of the spacing of
+    # the virtual channels, the whole half plane when they are not evenly
+    # spaced
+    spacing = radar.virtualSpacing
+    limit = 1 if spacing is None else min(1, 1 / (2 * spacing))
+    sines = linspace(-limit, limit, beams + 2)[1:-1]
+    return tuple(rad2deg(arcsin(sines)).tolist())
+
+def channelPower(radarCube, out, combine=add):
+    """
+    This function combines the power of every channel into the map, one 
+    channel at a time through a buffer of the size of the map
+    :param radarCube: numpy.array of shape (channels, ...)
+    :param out: numpy.array of the shape of a channel
+    :param combine: numpy.ufunc, add to sum the channels, maximum to keep 
+        the largest one
+    :return numpy.array
+    """
+    power = empty(out.shape, dtype=out.dtype)
+    for channel in radarCube:
+        abs(channel, out=power)
+        power *= power
+        combine(out, power, out=out)
+    return out
+
+@instrument("integration")
+def integrateChannels(radar, radarCube, mode="Noncoherent", angles=None, \
+    decibels=False, chunk=8192, out=None):
+    """
+    This function integrates the channels of a radar cube into a power map.
+    Non coherent is the mean power of the channels. A coherent beam has the
+    noise power of one channel and the array gain on a target in its 
+    direction, "Max Beam" keeps the largest beam of every cell.
+    :param radar: dict
+    :param radarCube: numpy.array of shape (channels, doppler, range)
+    :param mode: string, see MODES
+    :param angles: float for "Coherent", the steering angle in degrees (0 by
+        default), or list of angles for "Max Beam" (beamAngles by default)
+    :param decibels: boolean, return 10 log10 of the power
+    :param chunk: integer, cells beamformed together
+    :param out: numpy.array, optional real map to write into
+    :return numpy.array of shape (doppler, range)
+    """
+    radar = radarConfig(radar)
+    if mode not in MODES:
+        raise ValueError("Mode must be one of " + str(list(MODES)))
+    mapShape = radarCube.shape[1:]
+    if out is None:
+        out = empty(mapShape, dtype=radar.realType)
+
+    if mode == "Noncoherent":
+        out[...] = 0
+        channelPower(radarCube, out)
+        out /= radarCube.shape[0]
+    else:
+        if mode == "Coherent":
+            angles = [0 if angles is None else angles]
+        elif angles is None:
+            angles = beamAngles(radar)
+        weights = beamWeights(radar, tuple(angles), radar.complexType)
+        # Beams of a chunk of cells, the cells are whole rows of the map so
+        # the power is written through out even when it is not contiguous
+        cells = radarCube.reshape((radarCube.shape[0], -1))
+        rows = max(1, chunk // mapShape[-1])
+        for first in range(0, mapShape[0], rows):
+            power = out[first:first + rows]
+            beams = weights @ cells[:, first * mapShape[-1]:(first + \
+                power.shape[0]) * mapShape[-1]]
+            power[...] = 0
+            channelPower(beams.reshape((-1,) + power.shape), power, maximum)
+
+    if decibels:
+        log10(out, out=out)
+        out *= 10
+    return out
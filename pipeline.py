@@ -0,0 +1,385 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Streaming Pipeline Module
+# The processing chain as generators that pull from each other one block of
+# chirps at a time: synthesis -> mixer -> range FFT -> doppler FFT ->
+# detection -> angle. The range FFT runs as soon as a block of chirps has
+# arrived and only a fixed number of radar cubes are ever allocated, so the
+# memory does not grow with the number of frames.
+
+from io import StringIO
+from os import path
+from json import loads
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+from numpy import broadcast_to, empty, multiply, conj, iscomplexobj, repeat, \
+    ones
+from numpy.fft import fft, rfft, fftshift
+from test_config import RADAR, ENVIRONMENT
+from common import windowWeights, virtualView
+from transmitter import chirpGenerator
+from environment import radarChannel, beatChannel
+from receiver import signalMixer, calibrateChannels
+from detector import detectTargets
+from integration import integrateChannels
+from estimator import estimateAngles
+from configuration import radarConfig
+from targets import TargetTable, targetTable, clutterScene, \
+    concatenateTables
+from tracker import Tracker, detectionMeasurements
+from instrumentation import StageTimer, setFrame, addSink, removeSink, \
+    RingBufferSink, JsonLinesSink, PrometheusSink, PrintSink
+from visualization import RangeDopplerDisplay, displayStage, finishFigure
+
+def movingEnvironment(radar, environment, totalFrames, frameTime=None):
+    """
+    This function yields the environment of every frame, with the targets
+    moving at their velocity (positive is approaching) between the frames
+    :param radar: dict
+    :param environment: dict or targets.TargetTable, the targets at the
+        first frame
+    :param totalFrames: integer
+    :param frameTime: float, time between the frames, one frame of chirps by
+        default
+    :return generator of dict or TargetTable
+    """
+    if frameTime is None:
+        frameTime = radar["Chirp Time"] * radarConfig(radar).frameChirps
+    for iFrame in range(totalFrames):
+        if isinstance(environment, TargetTable):
+            yield environment.moved(frameTime * iFrame)
+            continue
+        frameEnvironment = dict(environment)
+        for iTarget in range(environment["Total Targets"]):
+            targetName = "Target " + str(iTarget + 1)
+            target = list(environment[targetName])
+            target[0] = target[0] - target[1] * frameTime * iFrame
+            frameEnvironment[targetName] = target
+        yield frameEnvironment
+
+def synthesisStage(radar, environments, blockChirps=16, closedForm=False, \
+    seed=None):
+    """
+    This function yields the received signal of every block of chirps of
+    every frame, or the mixer output directly for the closed form model
+    :param radar: dict
+    :param environments: iterable of dict or targets.TargetTable, one per
+        frame
+    :param blockChirps: integer, chirps per block, rounded up to whole turns
+        of the transmitters of a MIMO radar
+    :param closedForm: boolean, use environment.beatChannel
+    :param seed: integer, seed of the noise, see common.noiseGenerator. The
+        noise of a frame does not depend on the block size.
+    :return generator of (frame, firstChirp, transmitBlock, receivedBlock)
+    """
+    radar = radarConfig(radar)
+    totalChirps = radar.frameChirps
+    # Every block has the chirps of all the transmitters, so it can be 
+    # arranged in virtual channels on its own
+    blockChirps = -(-blockChirps // radar.totalTransmitters) * \
+        radar.totalTransmitters
+    # The transmitted block is the same for every block of every frame
+    chirpSignal = chirpGenerator(radar, False)
+    transmitBlock = broadcast_to(chirpSignal, (blockChirps, chirpSignal.size))
+    # The noise is drawn into one buffer per block size, every block is
+    # consumed before the next one is synthesized
+    noiseBuffers = {}
+    for iFrame, environment in enumerate(environments):
+        # The stages run one frame after the other, so the records of all
+        # the stages are tagged with the frame being synthesized
+        setFrame(iFrame)
+        for firstChirp in range(0, totalChirps, blockChirps):
+            chirps = min(blockChirps, totalChirps - firstChirp)
+            if chirps not in noiseBuffers:
+                noiseBuffers[chirps] = empty((radar.arraySize, chirps * \
+                    radar.totalSamples), dtype=radar.complexType)
+            noiseBuffer = noiseBuffers[chirps]
+            if closedForm:
+                yield iFrame, firstChirp, None, beatChannel(radar, \
+                    environment, firstChirp, chirps, seed, iFrame, \
+                    noiseBuffer.reshape((radar.arraySize, chirps, -1)))
+            else:
+                sequence = transmitBlock[:chirps]
+                yield iFrame, firstChirp, sequence, radarChannel(radar, \
+                    environment, sequence, firstChirp, seed, iFrame, \
+                    noiseBuffer)
+    setFrame(None)
+
+def mixerStage(radar, blocks):
+    """
+    This function yields the mixer output of every block of chirps, a
+    complex (IQ) transmit block is mixed with its conjugate
+    :param radar: dict
+    :param blocks: generator, see synthesisStage
+    :return generator of (frame, firstChirp, beatBlock)
+    """
+    for iFrame, firstChirp, transmitBlock, receivedBlock in blocks:
+        if transmitBlock is None:
+            # The closed form model is already the mixer output
+            yield iFrame, firstChirp, receivedBlock
+            continue
+        blockShape = (receivedBlock.shape[0],) + transmitBlock.shape
+        if iscomplexobj(transmitBlock):
+            transmitBlock = conj(transmitBlock)
+        yield iFrame, firstChirp, signalMixer(receivedBlock.reshape( \
+            blockShape), transmitBlock)
+
+def rangeStage(radar, blocks, halfSpectrum=True):
+    """
+    This function yields the range FFT of every block of chirps as soon as
+    it has arrived, with the windows and doppler centering of its chirps
+    :param radar: dict
+    :param blocks: generator, see mixerStage
+    :param halfSpectrum: boolean, see receiver.rangeDopplerFFT
+    :return generator of (frame, firstChirp, rangeBlock)
+    """
+    weights = windowWeights(radar, halfSpectrum)
+    # Every transmitter sends one chirp of each turn, and the chirps of a 
+    # turn share the weights of their doppler bin
+    totalTransmitters = radarConfig(radar).totalTransmitters
+    if totalTransmitters > 1:
+        weights = repeat(weights, totalTransmitters, axis=0)
+    for iFrame, firstChirp, beatBlock in blocks:
+        blockWeights = weights[firstChirp:firstChirp + beatBlock.shape[1]]
+        with StageTimer("range FFT", "rangeStage", iFrame) as timer:
+            if halfSpectrum:
+                rangeBlock = timer.done(rfft(multiply(beatBlock.real, \
+                    blockWeights), axis=-1))
+            else:
+                rangeBlock = timer.done(fft(multiply(beatBlock, \
+                    blockWeights), axis=-1))
+        yield iFrame, firstChirp, rangeBlock
+
+def dopplerStage(radar, blocks, framesInFlight=2, halfSpectrum=True):
+    """
+    This function collects the range FFT blocks of every frame into a radar
+    cube and yields the cube after the doppler FFT. The cubes are taken in
+    turn from a pool of framesInFlight cubes, so a yielded cube is only valid
+    until framesInFlight more frames have been pulled.
+    :param radar: dict
+    :param blocks: generator, see rangeStage
+    :param framesInFlight: integer, radar cubes allocated
+    :param halfSpectrum: boolean, see receiver.rangeDopplerFFT
+    :return generator of (frame, radarCube)
+    """
+    radar = radarConfig(radar)
+    totalChirps = radar.totalChirps
+    totalTransmitters = radar.totalTransmitters
+    totalSamples = radar.totalSamples
+    rangeBins = totalSamples // 2 + 1 if halfSpectrum else totalSamples
+    pool = [None] * framesInFlight
+    cube = None
+    for iFrame, firstChirp, rangeBlock in blocks:
+        if firstChirp == 0:
+            # Allocating the cubes only the first time they are needed
+            slot = iFrame % framesInFlight
+            if pool[slot] is None:
+                pool[slot] = empty((rangeBlock.shape[0] * totalTransmitters, \
+                    totalChirps, rangeBins), dtype=radar.complexType)
+            cube = pool[slot]
+        # The chirps of every transmitter go to its virtual channels
+        first = firstChirp // totalTransmitters
+        last = (firstChirp + rangeBlock.shape[1]) // totalTransmitters
+        cube.reshape((totalTransmitters, -1, totalChirps, rangeBins))[:, :, \
+            first:last] = virtualView(radar, rangeBlock)
+        if last == totalChirps:
+            with StageTimer("doppler FFT", "dopplerStage", iFrame) as timer:
+                fft(cube, axis=1, out=cube)
+                # The sign per chirp can not center an odd number of chirps
+                if halfSpectrum and totalChirps % 2:
+                    cube[...] = fftshift(cube, axes=1)
+                timer.done(calibrateChannels(radar, cube))
+            yield iFrame, cube
+
+def integrationStage(radar, frames, mode="Noncoherent", angles=None):
+    """
+    This function yields the power map of every radar cube. The map is
+    written into the same buffer for every frame, so a yielded map is only
+    valid until the next frame is pulled.
+    :param radar: dict
+    :param frames: generator, see dopplerStage
+    :param mode: string, see integration.integrateChannels
+    :param angles: see integration.integrateChannels
+    :return generator of (frame, radarCube, powerMap)
+    """
+    powerMap = None
+    for iFrame, radarCube in frames:
+        if powerMap is None or powerMap.shape != radarCube.shape[1:]:
+            powerMap = empty(radarCube.shape[1:], \
+                dtype=radarConfig(radar).realType)
+        yield iFrame, radarCube, integrateChannels(radar, radarCube, mode, \
+            angles, out=powerMap)
+
+def detectionStage(radar, frames, **detectorOptions):
+    """
+    This function yields the CFAR detections of every radar cube, found on
+    its power map
+    :param radar: dict
+    :param frames: generator, see integrationStage
+    :param detectorOptions: see detector.detectTargets
+    :return generator of (frame, radarCube, detections)
+    """
+    for iFrame, radarCube, powerMap in frames:
+        yield iFrame, radarCube, detectTargets(powerMap, **detectorOptions)
+
+def angleStage(radar, frames, method="FFT"):
+    """
+    This function yields the angle of every detection of every frame
+    :param radar: dict
+    :param frames: generator, see detectionStage
+    :param method: string, see estimator.estimateAngles
+    :return generator of (frame, detections, angles)
+    """
+    for iFrame, radarCube, detections in frames:
+        yield iFrame, detections, estimateAngles(radar, radarCube, \
+            detections, method)
+
+def trackingStage(radar, frames, tracker, halfSpectrum=True):
+    """
+    This function yields the confirmed tracks after every frame
+    :param radar: dict
+    :param frames: generator, see angleStage
+    :param tracker: tracker.Tracker
+    :param halfSpectrum: boolean, see receiver.rangeDopplerFFT
+    :return generator of (frame, tracks)
+    """
+    for iFrame, detections, angles in frames:
+        yield iFrame, tracker.update(detectionMeasurements(radar, detections, \
+            angles, halfSpectrum))
+
+def radarPipeline(radar, environments, blockChirps=16, framesInFlight=2, \
+    closedForm=False, halfSpectrum=True, method="FFT", seed=None, \
+    display=None, integration="Noncoherent", beams=None, **detectorOptions):
+    """
+    This function chains all the stages and yields the detections and their
+    angles frame by frame
+    :param radar: dict
+    :param environments: iterable of dict, one per frame, see
+        movingEnvironment
+    :param blockChirps: integer, chirps synthesized and range processed
+        together
+    :param framesInFlight: integer, radar cubes allocated
+    :param closedForm: boolean, synthesize the mixer output directly
+    :param halfSpectrum: boolean, only the positive ranges
+    :param method: string, angle estimator
+    :param seed: integer, seed of the noise, see synthesisStage
+    :param display: visualization.RangeDopplerDisplay, draws the map of
+        every frame
+    :param integration: string, how the channels are combined into the map
+        the targets are detected on, see integration.integrateChannels
+    :param beams: steering angle or angles of the beams, see
+        integration.integrateChannels
+    :param detectorOptions: see detector.detectTargets
+    :return generator of (frame, detections, angles)
+    """
+    blocks = synthesisStage(radar, environments, blockChirps, closedForm, \
+        seed)
+    blocks = rangeStage(radar, mixerStage(radar, blocks), halfSpectrum)
+    frames = dopplerStage(radar, blocks, framesInFlight, halfSpectrum)
+    frames = integrationStage(radar, frames, integration, beams)
+    if display is not None:
+        frames = displayStage(display, frames)
+    frames = detectionStage(radar, frames, **detectorOptions)
+    return angleStage(radar, frames, method)
+
+def test_radarPipeline():
+    # Stream a few frames of the moving targets through the whole chain
+    environments = movingEnvironment(RADAR, ENVIRONMENT, 5)
+    for iFrame, detections, angles in radarPipeline(RADAR, environments, \
+        closedForm=True):
+        print("Frame " + str(iFrame) + ": " + str(list(zip( \
+            detections["doppler"].tolist(), detections["range"].tolist(), \
+            angles.round(1).tolist()))))
+        assert detections.size == ENVIRONMENT["Total Targets"]
+
+def test_rangeDopplerDisplay():
+    # Draw the map of every frame into the same image while streaming
+    display = RangeDopplerDisplay(RADAR, halfSpectrum=True)
+    environments = movingEnvironment(RADAR, ENVIRONMENT, 20)
+    for iFrame, detections, angles in radarPipeline(RADAR, environments, \
+        closedForm=True, display=display, \
+        maxTargets=ENVIRONMENT["Total Targets"]):
+        pass
+    finishFigure(display.figure)
+
+def test_tracking():
+    # Follow the moving targets over the frames, the tracks are reported once
+    # they have been detected in three frames
+    frameTime = 0.05
+    environments = movingEnvironment(RADAR, ENVIRONMENT, 20, frameTime)
+    frames = radarPipeline(RADAR, environments, closedForm=True, seed=0, \
+        maxTargets=ENVIRONMENT["Total Targets"])
+    for iFrame, tracks in trackingStage(RADAR, frames, Tracker(RADAR, \
+        frameTime)):
+        print("Frame " + str(iFrame) + ": " + ", ".join("track {} at " \
+            "{:.1f}m, {:.1f}m/s, {:.1f} degrees".format(*track) for track in \
+            tracks[["identity", "range", "velocity", "angle"]].tolist()))
+
+def test_largeScene():
+    # Two strong targets in ten thousand weak clutter scatterers, the scene is
+    # synthesized in chunks of targets
+    clutter = clutterScene(10000, (50, RADAR["Range Resolution"] * \
+        RADAR["Time Samples in Chirp"] / 2), seed=0)
+    scene = concatenateTables([targetTable(ENVIRONMENT), clutter])
+    environments = movingEnvironment(RADAR, scene, 2)
+    for iFrame, detections, angles in radarPipeline(RADAR, environments, \
+        closedForm=True, seed=0, maxTargets=ENVIRONMENT["Total Targets"]):
+        print("Frame " + str(iFrame) + ": " + str(list(zip( \
+            detections["doppler"].tolist(), detections["range"].tolist(), \
+            angles.round(1).tolist()))))
+
+def test_sinks():
+    # Every sink records three frames of an instrumented stage and a timed
+    # block with its own frame
+    radar = radarConfig(RADAR)
+    radarCube = ones((radar.virtualSize, 8, 16), dtype=radar.complexType)
+    with TemporaryDirectory() as directory:
+        fileName = path.join(directory, "records.jsonl")
+        sinks = (RingBufferSink(), JsonLinesSink(fileName), PrometheusSink(), \
+            PrintSink())
+        ringBuffer, jsonLines, prometheus, _ = sinks
+        for sink in sinks:
+            addSink(sink)
+        output = StringIO()
+        try:
+            with redirect_stdout(output):
+                for iFrame in range(3):
+                    setFrame(iFrame)
+                    integrateChannels(radar, radarCube)
+                setFrame(None)
+                with StageTimer("block", "test_sinks", 7) as timer:
+                    timer.done(radarCube)
+        finally:
+            for sink in sinks:
+                removeSink(sink)
+            jsonLines.close()
+        with open(fileName) as file:
+            lines = [loads(line) for line in file]
+
+    # The stages and frames of the records, in the order of the calls
+    expected = [("integration", "integrateChannels", iFrame) for iFrame in \
+        range(3)] + [("block", "test_sinks", 7)]
+    for records in (ringBuffer.records(), lines):
+        assert [(record["stage"], record["function"], record["frame"]) for \
+            record in records] == expected
+    assert ringBuffer.records("block")[0]["shapes"] == [list(radarCube.shape)]
+    assert [line.split(" - ")[0] for line in output.getvalue().splitlines()] \
+        == [stage for stage, _, _ in expected]
+    assert prometheus.totals[("integration", "integrateChannels")][0] == 3
+    assert 'fmcw_stage_seconds_count{stage="block",function="test_sinks"} 1' \
+        in prometheus.exposition()
+    print(prometheus.exposition())
+
+# Run this file to stream a few frames through the processing chain
+if __name__ == '__main__':
+    test_radarPipeline()
+    # test_rangeDopplerDisplay()
+    # test_tracking()
+    # test_largeScene()
+    # test_sinks()
@@ -11,23 +11,32 @@
 
 from scipy.constants import c
 from math import pi, sin, radians
-import matplotlib.pyplot as plot
-from matplotlib import cm
-from numpy import multiply, linspace, copy, zeros, transpose, mean, log
-from numpy.fft import fft, fftshift
+from functools import lru_cache
+from numpy import multiply, linspace, mean, log10, argmax, empty, \
+    iscomplexobj, conj, result_type, array_equal, median
+from numpy.fft import fftshift
 from test_config import RADAR, ENVIRONMENT
-from common import powerSpectrum, findTargets, estimateAngle
+from common import findTargets, fftPlan, rangeAxis, windowWeights, \
+    channelCalibration, dopplerCompensation, virtualView
 from transmitter import chirpGenerator, sequenceGenerator
-from environment import radarChannel
-
-def signalMixer(signal1, signal2):
+from environment import radarChannel, beatChannel
+from estimator import estimateAngles
+from integration import integrateChannels, beamAngles
+from configuration import radarConfig
+from instrumentation import instrument
+from visualization import newFigure, linePanel, amplitudeSpectrum, \
+    finishFigure, RangeDopplerDisplay
+
+@instrument("mix")
+def signalMixer(signal1, signal2, out=None):
     """
     This function mixes two signals in by multiplying them
     :param signal1: numpy.array
     :param signal2: numpy.array
+    :param out: numpy.array, optional buffer for the output
     :return numpy.array
     """
-    return multiply(signal1, signal2)
+    return multiply(signal1, signal2, out=out)
 
 def test_signalMixer():
     # Generate the time axis for plotting the signal
@@ -53,70 +62,213 @@ def test_signalMixer():
     receiveSequence = radarChannel(RADAR, ENVIRONMENT, transmitSequence)
 
     # Processing just one channel for testing
-    channelSequence = transpose(receiveSequence[0, :])
+    channelSequence = receiveSequence[0, :].reshape(transmitSequence.shape)
 
     # Mixing the signals to get the beat signal
     beatSignal = signalMixer(transmitSequence, channelSequence)
 
     # Plotting the received signal to check for delay
-    fig = plot.figure()
     title = "Receive Chirp (Targets at: " + str(ENVIRONMENT["Target 1"][0]) + \
         "m and " + str(ENVIRONMENT["Target 2"][0]) + "m)"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    frequencyPlot = plot.subplot(211)
-    frequencyPlot.plot(range, powerSpectrum(beatSignal))
-    frequencyPlot.title.set_text('Mixer: Frequency Domain')
-    frequencyPlot.grid()
-
-    transmitPlot = plot.subplot(223)
-    transmitPlot.plot(frequency / 1e6, powerSpectrum(transmitSequence))
-    transmitPlot.title.set_text('Transmit: Frequency Domain')
-    transmitPlot.grid()
+    figure = newFigure(title)
+    totalSamples = RADAR["Time Samples in Chirp"]
+    linePanel(figure, 211, "Mixer: Frequency Domain", range, \
+        amplitudeSpectrum(beatSignal[0], totalSamples))
+    linePanel(figure, 223, "Transmit: Frequency Domain", frequency / 1e6, \
+        amplitudeSpectrum(transmitSequence[0], totalSamples))
+    linePanel(figure, 224, "Receive: Frequency Domain", frequency / 1e6, \
+        amplitudeSpectrum(channelSequence[0], totalSamples))
+    finishFigure(figure)
+
+def halfSpectrumShape(cubeShape):
+    """
+    This function returns the shape of a radar cube that only keeps the 
+    positive range bins
+    :param cubeShape: tuple
+    :return tuple
+    """
+    return tuple(cubeShape[:-1]) + (cubeShape[-1] // 2 + 1,)
 
-    receivePlot = plot.subplot(224)
-    receivePlot.plot(frequency / 1e6, powerSpectrum(channelSequence))
-    receivePlot.title.set_text('Receive: Frequency Domain')
-    receivePlot.grid()
+@instrument("range doppler FFT")
+def fullSpectrumFFT(radarCube, backend, workers):
+    """
+    This function calculates the range and doppler FFT of all the channels
+    in place
+    :param radarCube: numpy.array, complex of shape (channels, chirps, 
+        samples)
+    :param backend: string, FFT backend, see common.fftPlan
+    :param workers: integer, FFT threads
+    :return numpy.array
+    """
+    fftPlan(radarCube.shape, radarCube.dtype, backend, workers)(radarCube, \
+        radarCube)
+    return radarCube
 
-    plot.show()
+@instrument("range doppler FFT")
+def halfSpectrumFFT(beatCube, out, backend, workers):
+    """
+    This function calculates the range doppler maps from a real mixer output
+    using a real FFT in range, so only the positive range bins are computed
+    :param beatCube: numpy.array, real of shape (channels, chirps, samples)
+    :param out: numpy.array, complex cube of the half spectrum shape
+    :param backend: string, FFT backend, see common.fftPlan
+    :param workers: integer, FFT threads
+    :return numpy.array
+    """
+    fftPlan(beatCube.shape, beatCube.dtype, backend, workers, real=True)( \
+        beatCube, out)
+    # The sign per chirp can not center an odd number of chirps
+    if beatCube.shape[1] % 2:
+        out[...] = fftshift(out, axes=1)
+    return out
+
+def calibrateChannels(radar, radarCube, velocityAxis=None):
+    """
+    This function applies the gain and phase calibration of every channel to
+    the radar cube in place. The FFTs are linear so this is the same as
+    calibrating the mixer output, but on a cube that can be half the size.
+    The doppler shift between the transmitters of a MIMO radar is removed
+    as well, see common.dopplerCompensation.
+    :param radar: dict
+    :param radarCube: numpy.array of shape (channels, doppler, range)
+    :param velocityAxis: numpy.array, velocity of every doppler bin of a 
+        cube that does not have all of them
+    :return numpy.array
+    """
+    calibration = channelCalibration(radar)
+    if calibration is not None:
+        multiply(radarCube, calibration, out=radarCube)
+    compensation = dopplerCompensation(radar, velocityAxis)
+    if compensation is not None:
+        multiply(radarCube, compensation, out=radarCube)
+    return radarCube
+
+def rangeDopplerFFT(radar, beatCube, out=None, backend="numpy", workers=1, \
+    halfSpectrum=False):
+    """
+    This function calculates the range doppler maps of all the channels from
+    their mixer output. The chirps of the transmitters of a MIMO radar are 
+    arranged in their virtual channels on the way.
+    :param radar: dict
+    :param beatCube: numpy.array of shape (channels, chirps, samples)
+    :param out: numpy.array, optional complex cube to write the maps into
+    :param backend: string, FFT backend, see common.fftPlan
+    :param workers: integer, FFT threads
+    :param halfSpectrum: boolean, sample the real part of the mixer output and 
+        only keep the positive range bins
+    :return numpy.array of shape (virtual channels, chirps per transmitter,
+        samples)
+    """
+    radar = radarConfig(radar)
+    virtualCube = virtualView(radar, beatCube)
+    cubeShape = (-1,) + virtualCube.shape[2:]
+    if halfSpectrum:
+        # Real sampled mixer output with the windows and doppler centering
+        realCube = multiply(virtualCube.real, windowWeights(radar, True), \
+            dtype=radar.realType, order="C").reshape(cubeShape)
+        if out is None:
+            out = empty(halfSpectrumShape(realCube.shape), \
+                dtype=radar.complexType)
+        halfSpectrumFFT(realCube, out, backend, workers)
+        return calibrateChannels(radar, out)
+
+    if out is None:
+        out = empty(virtualCube.shape, dtype=radar.complexType)
+    # Apply the windows and the zero frequency centering in one multiply
+    multiply(virtualCube, windowWeights(radar), out=out.reshape( \
+        virtualCube.shape))
+    out = out.reshape(cubeShape)
+    # Calculate the FFT for range and doppler of all channels in one call
+    fullSpectrumFFT(out, backend, workers)
+    return calibrateChannels(radar, out)
+
+@lru_cache(maxsize=16)
+def cachedMixerWeights(radar, halfSpectrum):
+    # The radar chirp is the same for every chirp of every transmitter
+    chirpSignal = chirpGenerator(radar, False)
+    if iscomplexobj(chirpSignal):
+        chirpSignal = conj(chirpSignal)
+    weights = chirpSignal * windowWeights(radar, halfSpectrum)
+    weights.flags.writeable = False
+    return weights
+
+def mixerWeights(radar, transmitBlock, halfSpectrum):
+    """
+    This function returns the transmit side of the mixer: the (conjugated)
+    transmit block with the windows and the zero frequency centering, so 
+    they are applied to the transmit side only once. The repeated radar 
+    chirp of sequenceGenerator is weighted once per configuration, any 
+    other block on every call.
+    :param radar: RadarConfig
+    :param transmitBlock: numpy.array of shape (chirps, samples)
+    :param halfSpectrum: boolean
+    :return numpy.array that broadcasts to (transmitters, channels, chirps
+        per transmitter, samples)
+    """
+    if transmitBlock.strides[0] == 0 and array_equal(transmitBlock[0], \
+        chirpGenerator(radar, False)):
+        return cachedMixerWeights(radar, halfSpectrum)
+    if iscomplexobj(transmitBlock):
+        transmitBlock = conj(transmitBlock)
+    return virtualView(radar, transmitBlock)[:, None] * \
+        windowWeights(radar, halfSpectrum)
+
+def rangeDopplerProcessing(radar, transmitSequence, receivedSequence, \
+    out=None, backend="numpy", workers=1, halfSpectrum=False):
+    """
+    This function mixes the received signal of every channel with the 
+    transmitted sequence and calculates the range doppler maps. A complex (IQ)
+    transmit sequence is mixed with its conjugate. The chirps of the 
+    transmitters of a MIMO radar are arranged in their virtual channels.
+    :param radar: dict
+    :param transmitSequence: numpy.array
+    :param receivedSequence: numpy.array of shape (channels, samples)
+    :param out: numpy.array, optional complex cube to write the maps into
+    :param backend: string, FFT backend, see common.fftPlan
+    :param workers: integer, FFT threads
+    :param halfSpectrum: boolean, sample the real part of the mixer output and 
+        only keep the positive range bins
+    :return numpy.array of shape (virtual channels, chirps per transmitter,
+        samples)
+    """
+    radar = radarConfig(radar)
+    totalSamples = radar.totalSamples
+    # Chirps of every transmitter, the transmit side is the same for all the
+    # receivers
+    receivedCube = virtualView(radar, receivedSequence.reshape(( \
+        receivedSequence.shape[0], -1, totalSamples)))
+    transmitBlock = mixerWeights(radar, transmitSequence.reshape(( \
+        radar.frameChirps, totalSamples)), halfSpectrum)
+    cubeShape = (-1,) + receivedCube.shape[2:]
+
+    if halfSpectrum:
+        # Real sampled mixer output
+        if not iscomplexobj(transmitBlock):
+            receivedCube = receivedCube.real
+        beatCube = signalMixer(receivedCube, transmitBlock, out=empty( \
+            receivedCube.shape, dtype=result_type(receivedCube, \
+            transmitBlock))).real.reshape(cubeShape)
+        # Variable for output range doppler map
+        if out is None:
+            out = empty(halfSpectrumShape(beatCube.shape), \
+                dtype=radar.complexType)
+        halfSpectrumFFT(beatCube, out, backend, workers)
+        return calibrateChannels(radar, out)
 
-def rangeDopplerProcessing(radar, transmitSequence, receivedSequence):
     # Variable for output range doppler map
-    coherentCube = zeros((radar["Array Size"], radar["Number of Chirps"], \
-        radar["Time Samples in Chirp"]), dtype=complex)
-
-    # Process the received signal per channel
-    for iChannel in range(radar["Array Size"]):
-        # Signal received at the current channel
-        channelSequence = receivedSequence[iChannel, :]
-
-        # Calculate the mixer output for the channel
-        beatSignal = signalMixer(transmitSequence, channelSequence)
+    if out is None:
+        out = empty(receivedCube.shape, dtype=radar.complexType)
 
-        # Reshape the output for FFT processing
-        radarCube = copy(beatSignal).reshape(( \
-                radar["Number of Chirps"], radar["Time Samples in Chirp"]))
+    # Mix all the channels at once by broadcasting the transmit sequence
+    signalMixer(receivedCube, transmitBlock, out=out.reshape( \
+        receivedCube.shape))
+    out = out.reshape(cubeShape)
 
-        # Calculate the FFT for range
-        radarCube = fft(radarCube, axis=0)
-        radarCube = fft(radarCube, axis=1)
-        radarCube = fftshift(radarCube)
-
-        # Sum the rangle doppler maps
-        coherentCube[iChannel, :, :] = radarCube
-
-    # Return the processed cube
-    return coherentCube
+    # Calculate the FFT for range and doppler of all channels in one call
+    fullSpectrumFFT(out, backend, workers)
+    return calibrateChannels(radar, out)
 
 def test_rangeDopplerProcessing():
-    # Generate the time axis for plotting the signal
-    time = linspace(0, RADAR["Chirp Time"] * RADAR["Number of Chirps"], \
-        RADAR["Time Samples in Chirp"] * RADAR["Number of Chirps"])
-
-    # Creating the range axis to check for the target
-    rMax = (RADAR["Chirp Time"] * c) / (4 * RADAR["Chirp Bandwidth"] * time[1])
-
     # Generate a chirp signal
     chirpSignal = chirpGenerator(RADAR, False)
 
@@ -126,68 +278,258 @@ def test_rangeDopplerProcessing():
     # Creating the targets and the reflections
     receiveSequence = radarChannel(RADAR, ENVIRONMENT, transmitSequence)
 
-    # Calculate the Radar Cube
-    radarCube = rangeDopplerProcessing(RADAR, transmitSequence, receiveSequence)
+    # Calculate the Radar Cube, only the positive ranges are of interest
+    radarCube = rangeDopplerProcessing(RADAR, transmitSequence, \
+        receiveSequence, halfSpectrum=True)
 
-    # Calculate the average across the receivers incoherently
-    rangeDopplerMap = mean(abs(radarCube), axis=0)
+    # Calculate the power averaged across the receivers incoherently
+    powerMap = integrateChannels(RADAR, radarCube)
 
-    # Plotting the received signal to check for delay
-    fig = plot.figure()
+    # Plotting the Range Doppler Map, the negative range data was never 
+    # calculated
     title = "Range Doppler Map (Targets at: " + str(ENVIRONMENT["Target 1"][0]) + \
         "m and " + str(ENVIRONMENT["Target 2"][0]) + "m)"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    # Neglecting the negative range data
-    visualData = (transpose(abs(rangeDopplerMap[:, \
-        0:int(RADAR["Time Samples in Chirp"]/2)])))
-
-    # Plotting the Range Doppler Map
-    plot.imshow(visualData, extent=[-128, 128, 0, rMax])
-    plot.show()
-
-def angleEstimation(radar, radarCube):
-    angleData = zeros((radar["Number of Chirps"], radar["Time Samples in Chirp"]))
-    
-    for iDoppler in range(radar["Number of Chirps"]):
-        for iRange in range(radar["Time Samples in Chirp"]):
-            snapShot = radarCube[:, iDoppler, iRange]
-            angleData[iDoppler, iRange] = estimateAngle(snapShot)
-    return angleData
-
-def test_angleEstimation():
-    # Generate the time axis for plotting the signal
-    time = linspace(0, RADAR["Chirp Time"] * RADAR["Number of Chirps"], \
-        RADAR["Time Samples in Chirp"] * RADAR["Number of Chirps"])
+    display = RangeDopplerDisplay(RADAR, halfSpectrum=True, title=title)
+    display.update(powerMap)
+    finishFigure(display.figure)
 
+def test_beatChannel():
     # Creating the range axis to check for the target
-    rMax = (RADAR["Chirp Time"] * c) / (4 * RADAR["Chirp Bandwidth"] * time[1])
-
-    # Generate a chirp signal
-    chirpSignal = chirpGenerator(RADAR, False)
+    rMax = (RADAR["Time Samples in Chirp"] - 1) * c / (4 * RADAR["Chirp Bandwidth"])
+    rangeAxis = linspace(-rMax, rMax, RADAR["Time Samples in Chirp"])
+    positive = rangeAxis >= 0
 
     # Generate Chirp Sequence
+    chirpSignal = chirpGenerator(RADAR, False)
     transmitSequence = sequenceGenerator(RADAR, chirpSignal, False)
 
-    # Creating the targets and the reflections
-    receiveSequence = radarChannel(RADAR, ENVIRONMENT, transmitSequence)
+    # Plotting the range profiles of both the paths
+    figure = newFigure("Mixer vs Closed Form Beat Signal")
+
+    # Checking one target at a time, the aliased mixer products of a strong 
+    # target can otherwise hide a weaker one
+    for iTarget in range(ENVIRONMENT["Total Targets"]):
+        targetName = "Target " + str(iTarget + 1)
+        environment = {"Total Targets": 1, "Target 1": ENVIRONMENT[targetName]}
+
+        # Radar cube through the full chain: transmit, channel and mixer
+        receiveSequence = radarChannel(RADAR, environment, transmitSequence)
+        mixerCube = rangeDopplerProcessing(RADAR, transmitSequence, \
+            receiveSequence)
+
+        # Radar cube from the closed form beat signal
+        beatCube = rangeDopplerFFT(RADAR, beatChannel(RADAR, environment))
+
+        # Range profiles of the first channel for both the paths
+        mixerProfile = mean(abs(mixerCube[0]), axis=0)
+        beatProfile = mean(abs(beatCube[0]), axis=0)
+
+        # The peak should be in the same range bin up to the delay rounding
+        # of the mixer path
+        print(targetName + " at " + str(ENVIRONMENT[targetName][0]) + \
+            "m, Mixer: {:.1f}m, Beat: {:.1f}m".format( \
+            rangeAxis[positive][argmax(mixerProfile[positive])], \
+            rangeAxis[positive][argmax(beatProfile[positive])]))
+
+        linePanel(figure, (ENVIRONMENT["Total Targets"], 1, iTarget + 1), \
+            targetName, rangeAxis, [20 * log10(mixerProfile), \
+            20 * log10(beatProfile)], ["Mixer", "Beat"])
+
+    finishFigure(figure)
+
+def test_fractionalDelay():
+    # Targets one meter apart, less than the range bin of the delay rounding
+    # of the integer model. The fractional model has to follow them bin by
+    # bin like the closed form beat signal.
+    radar = dict(RADAR, **{"IQ Transmitter": True})
+    transmitSequence = sequenceGenerator(radar, chirpGenerator(radar, \
+        False), False)
+    rangeBins = rangeAxis(radar, halfSpectrum=True)
+    peaks = {"Integer": [], "Fractional": [], "Beat": []}
+    for targetRange in range(100, 105):
+        environment = {"Total Targets": 1, "Target 1": [targetRange, 0, 0]}
+        for model, fractional in (("Integer", False), ("Fractional", True)):
+            environment["Fractional Delay"] = fractional
+            radarCube = rangeDopplerProcessing(radar, transmitSequence, \
+                radarChannel(radar, environment, transmitSequence, seed=0), \
+                halfSpectrum=True)
+            peaks[model].append(argmax(integrateChannels(radar, \
+                radarCube).max(axis=0)))
+        beatCube = rangeDopplerFFT(radar, beatChannel(radar, environment, \
+            seed=0), halfSpectrum=True)
+        peaks["Beat"].append(argmax(integrateChannels(radar, \
+            beatCube).max(axis=0)))
+    for model, bins in peaks.items():
+        print(model + ": " + ", ".join("{:.2f}m".format(rangeBins[bin]) \
+            for bin in bins))
+
+    # The fractional peaks are the closed form peaks and move between the
+    # integer delay bins
+    assert peaks["Fractional"] == peaks["Beat"]
+    assert len(set(peaks["Fractional"])) == len(peaks["Fractional"])
+    assert len(set(peaks["Integer"])) < len(peaks["Integer"])
+
+    # Only the chirp of chirpGenerator can be delayed by the fractional model
+    try:
+        radarChannel(radar, environment, transmitSequence.conj(), seed=0)
+    except ValueError as error:
+        print(error)
+    else:
+        raise AssertionError("Another waveform was delayed")
+
+def angleEstimation(radar, radarCube, targetIndices=None, method="FFT", \
+    sources=1):
+    """
+    This function estimates the angle of arrival of the targets from the 
+    channels of the radar cube
+    :param radar: dict
+    :param radarCube: numpy.array of shape (channels, chirps, samples)
+    :param targetIndices: list of (doppler, range) indices or detections, the
+        whole cube is processed when not given
+    :param method: string, "FFT", "Bartlett", "MUSIC" or "Capon"
+    :param sources: integer, targets per cell for "MUSIC" and "Capon"
+    :return numpy.array of angles in degrees
+    """
+    return estimateAngles(radar, radarCube, targetIndices, method, \
+        sources=sources)
 
-    # Calculate the Radar Cube
-    radarCube = rangeDopplerProcessing(RADAR, transmitSequence, receiveSequence)
+def test_angleEstimation():
+    # Calculate the Radar Cube from the closed form beat signal, the aliased 
+    # mixer products of the near target would otherwise be detected as well
+    radarCube = rangeDopplerFFT(RADAR, beatChannel(RADAR, ENVIRONMENT), \
+        halfSpectrum=True)
 
-    # Calculate the average across the receivers incoherently
-    rangeDopplerMap = mean(abs(radarCube), axis=0)
+    # Calculate the power averaged across the receivers incoherently
+    powerMap = integrateChannels(RADAR, radarCube)
 
     # Find the range doppler bins of the target
-    targetIndices = findTargets(rangeDopplerMap, ENVIRONMENT["Total Targets"])
+    targetIndices = findTargets(powerMap, ENVIRONMENT["Total Targets"])
 
     # Extract the angle information based on array 
-    targetAngles = angleEstimation(radarCube, targetIndices)
+    targetAngles = angleEstimation(RADAR, radarCube, targetIndices, "Bartlett")
 
     # Print target details
-    print(targetAngles)
+    rangeBins = rangeAxis(RADAR, halfSpectrum=True)
+    for index, angle in zip(targetIndices, targetAngles):
+        print("Target at {:.1f}m: {:.1f} degrees".format(rangeBins[index[1]], \
+            angle))
+    assert len(targetIndices) == ENVIRONMENT["Total Targets"]
+
+def test_angleResolution():
+    # Two targets 7 degrees apart in the same range doppler cell, closer than
+    # the beamwidth of the array
+    environment = {"Total Targets": 2, "Target 1": [100, 10, 20], \
+        "Target 2": [100, 10, 27]}
+    radarCube = rangeDopplerFFT(RADAR, beatChannel(RADAR, environment, \
+        seed=0), halfSpectrum=True)
+    targetIndices = findTargets(integrateChannels(RADAR, radarCube), 1)
+    assert len(targetIndices) == 1
+
+    # MUSIC and Capon separate the targets, the FFT sees one between them
+    for method in ("MUSIC", "Capon"):
+        targetAngles = angleEstimation(RADAR, radarCube, targetIndices, \
+            method, sources=2)[0]
+        print(method + ": " + str(targetAngles.tolist()) + " degrees")
+        assert abs(targetAngles - [20, 27]).max() <= 1
+    fftAngle = angleEstimation(RADAR, radarCube, targetIndices)[0]
+    print("FFT: {:.1f} degrees".format(fftAngle))
+    assert 22 < fftAngle < 25
+
+def test_integration():
+    # One target off boresight, every map has its peak in the same cell
+    environment = {"Total Targets": 1, "Target 1": [100, 10, 30]}
+    radarCube = rangeDopplerFFT(RADAR, beatChannel(RADAR, environment, \
+        seed=0), halfSpectrum=True)
+    maps = {mode: integrateChannels(RADAR, radarCube, mode, angles) for \
+        mode, angles in (("Noncoherent", None), ("Max Beam", None), \
+        ("Coherent", 30))}
+    for mode, powerMap in maps.items():
+        print("{}: peak {:.1f}dB over the median".format(mode, 10 * \
+            log10(powerMap.max() / median(powerMap))))
+
+    # The largest beam of the fan raises the peak over the noise of the
+    # non coherent map
+    assert maps["Max Beam"].max() / median(maps["Max Beam"]) > \
+        maps["Noncoherent"].max() / median(maps["Noncoherent"])
+    # A beam steered at the target has the array gain over the mean power
+    # of the channels
+    gain = 10 * log10(maps["Coherent"].max() / maps["Noncoherent"].max())
+    print("Coherent gain: {:.2f}dB".format(gain))
+    assert abs(gain - 10 * log10(radarConfig(RADAR).virtualSize)) < 0.5
+
+    # The fan stays inside the field of view of the virtual spacing, one
+    # wavelength here, and covers the half plane when the virtual channels
+    # are not evenly spaced
+    assert max(beamAngles(dict(RADAR, **{"Array Size": 1, \
+        "Transmitter Positions": [0, 1]}))) < 30
+    assert beamAngles(dict(RADAR, **{"Array Size": 4, \
+        "Transmitter Positions": [0, 3]})) == beamAngles(RADAR, 16)
+
+def test_precision():
+    # The same scene with the IQ transmitter in double and single precision
+    cubes = {}
+    detections = {}
+    for precision in ("Double", "Single"):
+        radar = dict(RADAR, **{"IQ Transmitter": True, "Precision": precision})
+        transmitSequence = sequenceGenerator(radar, chirpGenerator(radar, \
+            False), False)
+        # Same noise seed for both the precisions
+        receiveSequence = radarChannel(radar, ENVIRONMENT, transmitSequence, \
+            seed=0)
+        # The scipy FFTs are the faster ones in single precision
+        cubes[precision] = rangeDopplerProcessing(radar, transmitSequence, \
+            receiveSequence, backend="scipy")
+
+        # Detections and angles of the precision
+        targetIndices = findTargets(integrateChannels(radar, \
+            cubes[precision]), ENVIRONMENT["Total Targets"])
+        targetAngles = angleEstimation(radar, cubes[precision], targetIndices)
+        detections[precision] = list(zip(targetIndices, \
+            targetAngles.round(2).tolist()))
+        print(precision + ": " + str(detections[precision]))
+        # The doppler sidelobes and rounding spurs are not detections
+        assert len(targetIndices) == ENVIRONMENT["Total Targets"]
+
+    # Both the precisions find the same targets at the same angles
+    assert detections["Single"] == detections["Double"]
+
+    # Largest error of the single precision cube relative to the peak, about
+    # -135dB for the 24 bit mantissa
+    error = 20 * log10(abs(cubes["Single"] - cubes["Double"]).max() / \
+        abs(cubes["Double"]).max())
+    print("Single precision error: {:.1f}dB of the peak".format(error))
+    assert error < -130
+
+def test_mimo():
+    # Three transmitters spaced by the receive aperture give a uniform 
+    # virtual array of 12 channels from 4 receivers. The velocities stay
+    # inside the unambiguous velocity of the three times longer turns.
+    radar = dict(RADAR, **{"Array Size": 4, "Transmitter Positions": \
+        [0, 2, 4]})
+    environment = dict(ENVIRONMENT, **{"Target 2": [150, -8, -45]})
+    radarCube = rangeDopplerFFT(radar, beatChannel(radar, environment, \
+        seed=0), halfSpectrum=True)
+    targetIndices = findTargets(integrateChannels(radar, radarCube), \
+        environment["Total Targets"])
+    targetAngles = angleEstimation(radar, radarCube, targetIndices)
+
+    # Without the doppler compensation the moving targets are seen at the
+    # wrong angle
+    uncompensated = radarCube * dopplerCompensation(radar).conj()
+    rawAngles = angleEstimation(radar, uncompensated, targetIndices)
+    rangeBins = rangeAxis(radar, halfSpectrum=True)
+    for index, angle, rawAngle in zip(targetIndices, targetAngles, \
+        rawAngles):
+        print("Target at {:.1f}m: {:.1f} degrees, {:.1f} degrees without " \
+            "compensation".format(rangeBins[index[1]], angle, rawAngle))
+    assert len(targetIndices) == environment["Total Targets"]
 
 if __name__ == '__main__':
     # test_signalMixer()
     test_rangeDopplerProcessing()
-    # test_angleEstimation()
\ No newline at end of file
+    # test_angleEstimation()
+    # test_angleResolution()
+    # test_integration()
+    # test_fractionalDelay()
+    # test_precision()
+    # test_mimo()
\ No newline at end of file
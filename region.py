@@ -0,0 +1,210 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Region Of Interest Module
+# It calculates the radar cube only over a window of ranges and/or a band of
+# velocities instead of the whole range doppler map. The gated axis is
+# evaluated on its own grid with a zoom DFT: a DFT matrix when the region 
+# has few bins, a chirp-z transform (scipy ZoomFFT) otherwise, so the bins
+# can be finer than the FFT bins. On the FFT grid the FFT is used and the
+# window is cut out of it. The doppler transform only runs over the range 
+# bins of the region. The region cube is the same as the half spectrum cube
+# (see receiver.rangeDopplerFFT) at the same bins, so the detector and the 
+# angle estimators work on it unchanged, with the axes of regionAxes.
+
+from math import floor, ceil
+from time import perf_counter
+from functools import lru_cache
+from numpy import arange, exp, outer, pi, multiply, iscomplexobj
+from numpy.fft import rfft, fft, fftshift
+from scipy.signal import ZoomFFT
+from test_config import RADAR, ENVIRONMENT
+from common import windowFunction, virtualView
+from environment import beatChannel
+from receiver import calibrateChannels, rangeDopplerFFT
+from detector import detectTargets
+from integration import integrateChannels
+from estimator import estimateAngles
+from tracker import detectionMeasurements
+from configuration import radarConfig
+from instrumentation import instrument
+
+def gridBins(step, limits, zoom):
+    """
+    This function returns the first and last bin of a grid of step / zoom
+    that covers the limits
+    :param step: float, bin of the FFT
+    :param limits: tuple, smallest and largest value
+    :param zoom: integer, bins of the region per FFT bin
+    :return tuple of integer
+    """
+    # The rounding keeps limits that are on the grid from gaining a bin
+    return floor(round(limits[0] * zoom / step, 9)), \
+        ceil(round(limits[1] * zoom / step, 9))
+
+def regionAxes(radar, ranges=None, velocities=None, zoom=(1, 1)):
+    """
+    This function returns the range and velocity of every bin of the region
+    :param radar: dict
+    :param ranges: tuple, smallest and largest range in meters, all the 
+        positive ranges by default
+    :param velocities: tuple, smallest and largest velocity, all the 
+        velocities by default
+    :param zoom: tuple, bins per FFT bin in range and in velocity
+    :return numpy.array, range axis, and numpy.array, velocity axis
+    """
+    radar = radarConfig(radar)
+    if ranges is None:
+        rangeAxis = radar.halfRangeAxis
+    else:
+        first, last = gridBins(radar.rangeBin, ranges, zoom[0])
+        rangeAxis = radar.rangeBin / zoom[0] * arange(first, last + 1)
+    if velocities is None:
+        velocityAxis = radar.velocityAxis
+    else:
+        first, last = gridBins(radar.velocityBin, velocities, zoom[1])
+        velocityAxis = radar.velocityBin / zoom[1] * arange(first, last + 1)
+    return rangeAxis, velocityAxis
+
+@lru_cache(maxsize=32)
+def zoomPlan(size, first, last, zoom, window, attenuation, complexType):
+    """
+    This function returns the windowed DFT of size samples at the
+    frequencies first / (zoom * size) to last / (zoom * size) in cycles per
+    sample
+    :param size: integer
+    :param first: integer, first bin of the zoomed grid
+    :param last: integer, last bin of the zoomed grid
+    :param zoom: integer, bins per FFT bin
+    :param window: string, see common.windowFunction
+    :param attenuation: float, see common.windowFunction
+    :param complexType: numpy.dtype, type of the output
+    :return function (data, axis) that returns the transform along the last
+        (-1) or the second last (-2) axis
+    """
+    bins = last - first + 1
+    weights = windowFunction(window, size, attenuation)
+    if not isNarrow(size, bins):
+        transform = ZoomFFT(size, (first / (zoom * size), last / (zoom * \
+            size)), bins, fs=1, endpoint=True)
+        shape = {-1: (size,), -2: (size, 1)}
+        def plan(data, axis):
+            return transform(data * weights.reshape(shape[axis]), \
+                axis=axis).astype(complexType)
+        return plan
+
+    # The window is applied by the rows of the matrix
+    matrix = (weights[:, None] * exp(-2j * pi * outer(arange(size), \
+        arange(first, last + 1) / (zoom * size)))).astype(complexType)
+    # Real and imaginary columns side by side, so a real input only needs a
+    # real product that is read back as complex
+    realMatrix = matrix[:, :, None].view(matrix.real.dtype).reshape((size, -1))
+    def plan(data, axis):
+        if axis == -1:
+            if iscomplexobj(data):
+                return data @ matrix
+            return (data @ realMatrix).view(complexType)
+        return matrix.T @ data
+    return plan
+
+def isNarrow(size, bins):
+    """
+    This function tells if a DFT matrix is faster than an FFT or a chirp-z
+    transform: the matrix costs size operations per bin, the transforms
+    about a few operations per sample
+    :param size: integer
+    :param bins: integer
+    :return boolean
+    """
+    return 4 * bins <= size
+
+@instrument("region")
+def regionProcessing(radar, beatCube, ranges=None, velocities=None, \
+    zoom=(1, 1)):
+    """
+    This function calculates the radar cube of a region of ranges and 
+    velocities from the mixer output, sampling its real part like the half
+    spectrum cube
+    :param radar: dict
+    :param beatCube: numpy.array of shape (channels, chirps, samples)
+    :param ranges: tuple, see regionAxes
+    :param velocities: tuple, see regionAxes
+    :param zoom: tuple, see regionAxes
+    :return numpy.array of shape (virtual channels, velocity bins, range 
+        bins)
+    """
+    radar = radarConfig(radar)
+    totalChirps = radar.totalChirps
+    totalSamples = radar.totalSamples
+    attenuation = radar.chebyshevAttenuation
+
+    # Range: a wide region on the FFT grid is cut out of the FFT
+    first, last = (0, totalSamples // 2) if ranges is None else \
+        gridBins(radar.rangeBin, ranges, zoom[0])
+    if zoom[0] == 1 and first >= 0 and last <= totalSamples // 2 and not \
+        isNarrow(totalSamples, last - first + 1):
+        rangeCube = rfft(multiply(beatCube.real, windowFunction( \
+            radar.rangeWindow, totalSamples, attenuation), \
+            dtype=radar.realType), axis=-1)[..., first:last + 1]
+    else:
+        rangeCube = zoomPlan(totalSamples, first, last, zoom[0], \
+            radar.rangeWindow, attenuation, radar.complexType)( \
+            beatCube.real.astype(radar.realType, copy=False), -1)
+
+    # Doppler: only over the range bins of the region and the chirps of
+    # every transmitter, the FFT bins are centered on zero velocity like the
+    # half spectrum cube
+    rangeCube = virtualView(radar, rangeCube)
+    lowest = -(totalChirps // 2)
+    first, last = (lowest, totalChirps - 1 + lowest) if velocities is None \
+        else gridBins(radar.velocityBin, velocities, zoom[1])
+    if zoom[1] == 1 and first >= lowest and last < totalChirps + lowest \
+        and not isNarrow(totalChirps, last - first + 1):
+        # The range cube is new, so the cached window is applied in place
+        multiply(rangeCube, windowFunction(radar.dopplerWindow, totalChirps, \
+            attenuation)[:, None], out=rangeCube)
+        regionCube = fftshift(fft(rangeCube, axis=-2), axes=-2)[..., \
+            first - lowest:last - lowest + 1, :]
+    else:
+        regionCube = zoomPlan(totalChirps, first, last, zoom[1], \
+            radar.dopplerWindow, attenuation, radar.complexType)( \
+            rangeCube, -2)
+    regionCube = regionCube.reshape((-1,) + regionCube.shape[-2:])
+    return calibrateChannels(radar, regionCube.astype(radar.complexType, \
+        copy=False), regionAxes(radar, ranges, velocities, zoom)[1])
+
+def test_regionProcessing():
+    # Process only a window around the first target with bins twice as fine
+    # as the FFT, and compare with the whole cube
+    target = ENVIRONMENT["Target 1"]
+    ranges = (target[0] - 10, target[0] + 10)
+    velocities = (target[1] - 2, target[1] + 2)
+    beatCube = beatChannel(RADAR, ENVIRONMENT, seed=0)
+
+    start = perf_counter()
+    radarCube = rangeDopplerFFT(RADAR, beatCube, halfSpectrum=True)
+    fullTime = perf_counter() - start
+    start = perf_counter()
+    regionCube = regionProcessing(RADAR, beatCube, ranges, velocities, (2, 2))
+    regionTime = perf_counter() - start
+    print("Whole cube {} in {:.1f}ms, region {} in {:.1f}ms".format( \
+        radarCube.shape, 1e3 * fullTime, regionCube.shape, 1e3 * regionTime))
+
+    # The guard cells cover the wider peak of the finer bins
+    detections = detectTargets(integrateChannels(RADAR, regionCube), \
+        guard=(4, 4), training=(4, 4), maxTargets=1)
+    measurements = detectionMeasurements(RADAR, detections, estimateAngles( \
+        RADAR, regionCube, detections), axes=regionAxes(RADAR, ranges, \
+        velocities, (2, 2)))
+    for measurement in measurements.tolist():
+        print("Target at {:.2f}m, {:.2f}m/s, {:.1f} degrees".format( \
+            *measurement))
+
+# Run this file to process the region around a target
+if __name__ == '__main__':
+    test_regionProcessing()
@@ -0,0 +1,299 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Cube Store Module
+# It archives the cubes of many frames (received signals, mixer outputs or
+# range doppler maps) in one binary file per store, next to a header with
+# the radar configuration and one line of json metadata per frame. The file
+# is memory mapped when it is read, so a frame, a channel or a range window
+# is sliced out without loading the rest of it. Stored received or mixer
+# cubes can be processed again without synthesizing them.
+
+import json
+from os import makedirs
+from os.path import join, exists, getsize
+from tempfile import TemporaryDirectory
+from math import prod
+from numpy import memmap, empty, ascontiguousarray, array_equal, \
+    dtype as numpyType
+from test_config import RADAR, ENVIRONMENT
+from configuration import radarConfig
+from targets import TargetTable, clutterScene
+from transmitter import chirpGenerator, sequenceGenerator
+from environment import beatChannel
+from receiver import rangeDopplerFFT, rangeDopplerProcessing
+from pipeline import movingEnvironment, integrationStage, detectionStage, \
+    angleStage
+from instrumentation import setFrame
+
+# Files of a store directory
+HEADER = "store.json"
+DATA = "cubes.dat"
+METADATA = "frames.jsonl"
+
+# Kinds of cubes that can be stored
+KINDS = ("received", "beat", "rangeDoppler")
+
+def encodeValue(value):
+    """
+    This function converts the values json can not store (numpy values, 
+    complex numbers and target tables), it is the default of json.dumps
+    :param value: complex, numpy value or targets.TargetTable
+    :return json value
+    """
+    if isinstance(value, TargetTable):
+        return {"targets": {name: getattr(value, name) for name in \
+            TargetTable.__slots__}}
+    if hasattr(value, "tolist"):
+        value = value.tolist()
+        if not isinstance(value, complex):
+            return value
+    if isinstance(value, complex):
+        return {"complex": [value.real, value.imag]}
+    raise TypeError("Can not store " + type(value).__name__ + " in json")
+
+def decodeValue(values):
+    """
+    This function restores the complex numbers and the target tables, it is
+    the object_hook of json.loads
+    :param values: dict
+    :return dict, complex or targets.TargetTable
+    """
+    if list(values) == ["complex"]:
+        return complex(*values["complex"])
+    if list(values) == ["targets"]:
+        return TargetTable(**values["targets"])
+    return values
+
+class CubeStore():
+    """
+    CubeStore class appends cubes of one shape to a store directory and
+    reads them back from a memory map.
+    """
+
+    def __init__(self, directory):
+        """
+        CubeStore object constructor that opens an existing store, see create
+        for a new one
+        :param directory: string
+        """
+        with open(join(directory, HEADER)) as file:
+            header = json.load(file, object_hook=decodeValue)
+        self.directory = directory
+        self.radar = radarConfig(header["radar"])
+        self.kind = header["kind"]
+        self.cubeShape = tuple(header["shape"])
+        self.dtype = numpyType(header["dtype"])
+        self.frameBytes = self.dtype.itemsize * prod(self.cubeShape)
+        self.dataFile = None
+        self.metadataFile = None
+        self.mapped = None
+        self.frameMetadata = []
+
+    @classmethod
+    def create(cls, directory, radar, cubeShape, kind="rangeDoppler", \
+        dtype=None):
+        """
+        This function creates an empty store
+        :param directory: string, created if it does not exist
+        :param radar: dict or RadarConfig
+        :param cubeShape: tuple, shape of one frame
+        :param kind: string, "received", "beat" or "rangeDoppler"
+        :param dtype: numpy type, the complex type of the radar by default
+        :return CubeStore
+        """
+        radar = radarConfig(radar)
+        if kind not in KINDS:
+            raise ValueError("Unknown kind of cube: " + str(kind))
+        makedirs(directory, exist_ok=True)
+        if exists(join(directory, HEADER)):
+            raise FileExistsError("There already is a store in " + directory)
+        # The type is stored with its byte order so the file is portable
+        header = {"radar": radar.toDict(), "kind": kind, \
+            "shape": list(cubeShape), \
+            "dtype": numpyType(dtype or radar.complexType).str}
+        open(join(directory, DATA), "wb").close()
+        open(join(directory, METADATA), "w").close()
+        with open(join(directory, HEADER), "w") as file:
+            json.dump(header, file, default=encodeValue, indent=4)
+        return cls(directory)
+
+    def append(self, cube, metadata=None):
+        """
+        This function appends one frame, any array with the size of a frame
+        is reshaped to the cube shape (e.g. the output of radarChannel)
+        :param cube: numpy.array
+        :param metadata: dict, e.g. the environment of the frame
+        :return integer, index of the frame
+        """
+        return self.extend(cube.reshape((1,) + self.cubeShape), [metadata])
+
+    def extend(self, cubes, metadata=None):
+        """
+        This function appends a block of frames with one write
+        :param cubes: numpy.array of shape (frames,) + cube shape
+        :param metadata: list of dict, one per frame
+        :return integer, index of the first frame
+        """
+        cubes = cubes.reshape((len(cubes),) + self.cubeShape)
+        if metadata is None:
+            metadata = [None] * len(cubes)
+        if len(metadata) != len(cubes):
+            raise ValueError("The metadata needs one entry per frame")
+        firstFrame = len(self)
+        if self.dataFile is None:
+            self.dataFile = open(join(self.directory, DATA), "ab")
+            self.metadataFile = open(join(self.directory, METADATA), "a")
+        # Only cubes of another type or layout are copied before the write
+        ascontiguousarray(cubes, dtype=self.dtype).tofile(self.dataFile)
+        for iFrame, frameMetadata in enumerate(metadata):
+            self.metadataFile.write(json.dumps(dict(frameMetadata or {}, \
+                frame=firstFrame + iFrame), default=encodeValue) + "\n")
+        return firstFrame
+
+    def flush(self):
+        if self.dataFile is not None:
+            self.dataFile.flush()
+            self.metadataFile.flush()
+
+    def close(self):
+        self.flush()
+        if self.dataFile is not None:
+            self.dataFile.close()
+            self.metadataFile.close()
+        self.dataFile = None
+        self.metadataFile = None
+        self.mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        # Frames still in the write buffer are counted as well
+        self.flush()
+        return getsize(join(self.directory, DATA)) // self.frameBytes
+
+    @property
+    def frames(self):
+        """
+        Memory map of all the frames of shape (frames,) + cube shape, it is
+        only mapped again when frames have been appended
+        """
+        totalFrames = len(self)
+        if totalFrames == 0:
+            return empty((0,) + self.cubeShape, dtype=self.dtype)
+        if self.mapped is None or len(self.mapped) != totalFrames:
+            self.mapped = memmap(join(self.directory, DATA), mode="r", \
+                dtype=self.dtype, shape=(totalFrames,) + self.cubeShape)
+        return self.mapped
+
+    def __getitem__(self, index):
+        """
+        Slicing the store slices the memory map, e.g. store[10, 2] is channel
+        2 of frame 10 and store[:, :, :, 20:40] a range window of every frame.
+        Nothing is read from the file until the values are used.
+        """
+        return self.frames[index]
+
+    def metadata(self, iFrame=None):
+        """
+        This function returns the metadata of one or all the frames
+        :param iFrame: integer, all the frames by default
+        :return dict or list of dict
+        """
+        self.flush()
+        if len(self.frameMetadata) < len(self):
+            # Only the lines that are not read yet are parsed
+            with open(join(self.directory, METADATA)) as file:
+                lines = file.readlines()[len(self.frameMetadata):]
+            self.frameMetadata.extend(json.loads(line, \
+                object_hook=decodeValue) for line in lines)
+        if iFrame is None:
+            return self.frameMetadata
+        return self.frameMetadata[iFrame]
+
+def storedFrames(store, frames=None, halfSpectrum=True, backend="numpy", \
+    workers=1):
+    """
+    This function yields the range doppler maps of the stored frames without
+    synthesizing them again. Received and mixer cubes are processed into one
+    radar cube that is reused, so a yielded cube is only valid until the next
+    one is pulled. Range doppler cubes are yielded as memory map slices.
+    :param store: CubeStore
+    :param frames: iterable of integer, all the frames by default
+    :param halfSpectrum: boolean, see receiver.rangeDopplerFFT
+    :param backend: string, FFT backend, see common.fftPlan
+    :param workers: integer, FFT threads
+    :return generator of (frame, radarCube), see pipeline.detectionStage
+    """
+    radar = store.radar
+    if store.kind == "received":
+        transmitSequence = sequenceGenerator(radar, chirpGenerator(radar, \
+            False), False)
+    radarCube = None
+    for iFrame in range(len(store)) if frames is None else frames:
+        setFrame(iFrame)
+        cube = store[iFrame]
+        if store.kind == "rangeDoppler":
+            yield iFrame, cube
+        elif store.kind == "beat":
+            radarCube = rangeDopplerFFT(radar, cube, radarCube, backend, \
+                workers, halfSpectrum)
+            yield iFrame, radarCube
+        else:
+            radarCube = rangeDopplerProcessing(radar, transmitSequence, \
+                cube.reshape((cube.shape[0], -1)), radarCube, backend, \
+                workers, halfSpectrum)
+            yield iFrame, radarCube
+
+def test_cubeStore():
+    with TemporaryDirectory() as directory:
+        # Archive the mixer output of a few frames of the moving targets
+        shape = (RADAR["Array Size"], RADAR["Number of Chirps"], \
+            RADAR["Time Samples in Chirp"])
+        with CubeStore.create(directory, RADAR, shape, "beat") as store:
+            for iFrame, environment in enumerate(movingEnvironment(RADAR, \
+                ENVIRONMENT, 4)):
+                store.append(beatChannel(RADAR, environment, seed=0, \
+                    frame=iFrame), {"environment": environment})
+
+        # Open the store again and only read one channel of the last frame
+        store = CubeStore(directory)
+        print("Stored frames: " + str(len(store)) + ", channel 0 of the " \
+            "last frame: " + str(store[-1, 0].shape))
+
+        # Process the stored frames again, skipping the synthesis
+        frames = detectionStage(store.radar, integrationStage(store.radar, \
+            storedFrames(store)))
+        for iFrame, detections, angles in angleStage(store.radar, frames):
+            print("Frame " + str(iFrame) + " " + \
+                str(store.metadata(iFrame)["environment"]["Target 1"]) + \
+                ": " + str(list(zip(detections["range"].tolist(), \
+                angles.round(1).tolist()))))
+            assert detections.size == ENVIRONMENT["Total Targets"]
+        store.close()
+
+def test_tableMetadata():
+    # The columnar scene of a frame is stored in its metadata and read back
+    # unchanged
+    scene = clutterScene(100, (50, 200), seed=0)
+    with TemporaryDirectory() as directory:
+        with CubeStore.create(directory, RADAR, (1,)) as store:
+            store.append(empty(1, dtype=store.dtype), {"environment": scene})
+        stored = CubeStore(directory).metadata(0)["environment"]
+    for name in TargetTable.__slots__:
+        assert array_equal(getattr(stored, name), getattr(scene, name))
+    print("Stored " + str(len(stored)) + " targets in the frame metadata")
+
+# Run this file to archive a few frames and process them again
+if __name__ == '__main__':
+    test_cubeStore()
+    # test_tableMetadata()
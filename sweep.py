@@ -0,0 +1,276 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Scenario Sweep Module
+# It runs many scenarios (environment dicts) through the processing chain on
+# a pool of processes. Every worker prepares the transmit chirp, the windows
+# and the steering grid of the radar once and reuses them for all of its
+# scenarios. The radar cubes are written into shared memory instead of being
+# pickled back, and the detections are collected into one table of columns.
+
+from math import prod
+from itertools import product
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from numpy import ndarray, concatenate, zeros, int32, float64, array_equal
+from test_config import RADAR, ENVIRONMENT
+from common import windowWeights, rangeAxis, velocityAxis
+from transmitter import chirpGenerator, sequenceGenerator
+from environment import radarChannel, beatChannel
+from receiver import rangeDopplerFFT, rangeDopplerProcessing, \
+    halfSpectrumShape
+from detector import detectTargets
+from integration import integrateChannels
+from estimator import estimateAngles, steeringGrid
+from configuration import radarConfig
+from instrumentation import setFrame
+from visualization import headless
+
+# Columns of the sweep summary, one row per detection
+SUMMARY = [("scenario", int32), ("doppler", int32), ("range", int32), \
+    ("power", float64), ("noise", float64), ("rangeMeters", float64), \
+    ("velocity", float64), ("angle", float64)]
+
+# Radar, options and precomputed data of the worker process
+workerState = {}
+
+def scenarioGrid(environment, target=1, ranges=None, velocities=None, \
+    angles=None):
+    """
+    This function returns the environments of every combination of range,
+    velocity and angle of one target of the base environment
+    :param environment: dict, the base environment
+    :param target: integer, number of the target that is varied
+    :param ranges: list, the range of the target by default
+    :param velocities: list, the velocity of the target by default
+    :param angles: list, the angle of the target by default
+    :return list of dict
+    """
+    targetName = "Target " + str(target)
+    base = environment[targetName]
+    scenarios = []
+    for values in product(ranges or [base[0]], velocities or [base[1]], \
+        angles or [base[2]]):
+        scenario = dict(environment)
+        scenario[targetName] = list(values)
+        scenarios.append(scenario)
+    return scenarios
+
+def cubeShape(radar, halfSpectrum):
+    """
+    This function returns the shape of the radar cube of one scenario
+    :param radar: dict
+    :param halfSpectrum: boolean
+    :return tuple
+    """
+    radar = radarConfig(radar)
+    shape = (radar.virtualSize, radar.totalChirps, radar.totalSamples)
+    return halfSpectrumShape(shape) if halfSpectrum else shape
+
+class SweepCubes():
+    """
+    SweepCubes class holds the radar cubes of a sweep in the shared memory
+    the workers wrote them into, so they are not copied. It releases the
+    shared memory when it is closed.
+    """
+
+    def __init__(self, memory, shape, dtype):
+        """
+        SweepCubes object constructor
+        :param memory: multiprocessing.shared_memory.SharedMemory
+        :param shape: tuple, (scenarios, channels, chirps, range bins)
+        :param dtype: numpy type
+        """
+        self.memory = memory
+        self.cubes = ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    def close(self):
+        """
+        This function releases the shared memory, the arrays taken from the
+        cubes have to be deleted before
+        """
+        if self.memory is None:
+            return
+        self.cubes = None
+        self.memory.unlink()
+        self.memory.close()
+        self.memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        return len(self.cubes)
+
+    def __getitem__(self, index):
+        return self.cubes[index]
+
+def sweepInitializer(radar, options, memoryName, totalScenarios):
+    """
+    This function prepares a worker process: the radar configuration, the
+    transmit sequence, the cached windows and steering grid and the view of
+    the shared radar cubes. Workers never show figures, so they are headless.
+    :param radar: dict
+    :param options: dict, see runSweep
+    :param memoryName: string, name of the shared memory or None
+    :param totalScenarios: integer
+    """
+    headless()
+    workerState["radar"] = radar
+    workerState["options"] = options
+    chirpSignal = chirpGenerator(radar, False)
+    workerState["transmit"] = sequenceGenerator(radar, chirpSignal, False)
+    windowWeights(radar, options["halfSpectrum"])
+    steeringGrid(radar)
+    workerState["cubes"] = None
+    if memoryName is not None:
+        workerState["memory"] = shared_memory.SharedMemory(name=memoryName)
+        workerState["cubes"] = ndarray((totalScenarios,) + cubeShape(radar, \
+            options["halfSpectrum"]), dtype=radarConfig(radar).complexType, \
+            buffer=workerState["memory"].buf)
+
+def sweepScenario(task):
+    """
+    This function runs one scenario through the chain in a worker process
+    :param task: tuple, (scenario index, environment)
+    :return numpy.array of type SUMMARY
+    """
+    iScenario, environment = task
+    radar = workerState["radar"]
+    options = workerState["options"]
+    cubes = workerState["cubes"]
+    out = None if cubes is None else cubes[iScenario]
+    setFrame(iScenario)
+
+    # The noise of every scenario is seeded by its index, so it does not
+    # depend on the worker that runs it
+    if options["closedForm"]:
+        radarCube = rangeDopplerFFT(radar, beatChannel(radar, environment, \
+            seed=options["seed"], frame=iScenario), out=out, \
+            halfSpectrum=options["halfSpectrum"])
+    else:
+        transmitSequence = workerState["transmit"]
+        radarCube = rangeDopplerProcessing(radar, transmitSequence, \
+            radarChannel(radar, environment, transmitSequence, \
+            seed=options["seed"], frame=iScenario), out=out, \
+            halfSpectrum=options["halfSpectrum"])
+
+    detections = detectTargets(integrateChannels(radar, radarCube, \
+        options["integration"], options["beams"]), **options["detector"])
+    rows = zeros(detections.size, dtype=SUMMARY)
+    rows["scenario"] = iScenario
+    for name in ("doppler", "range", "power", "noise"):
+        rows[name] = detections[name]
+    rows["rangeMeters"] = rangeAxis(radar, options["halfSpectrum"])[ \
+        detections["range"]]
+    rows["velocity"] = velocityAxis(radar)[detections["doppler"]]
+    rows["angle"] = estimateAngles(radar, radarCube, detections, \
+        options["method"])
+    return rows
+
+def runSweep(radar, scenarios, workers=None, closedForm=True, \
+    halfSpectrum=True, method="FFT", keepCubes=False, chunkSize=4, \
+    seed=None, integration="Noncoherent", beams=None, **detectorOptions):
+    """
+    This function runs all the scenarios through the processing chain on a
+    pool of processes
+    :param radar: dict
+    :param scenarios: list of environment dicts, see scenarioGrid
+    :param workers: integer, processes, all the cores by default
+    :param closedForm: boolean, synthesize the mixer output directly
+    :param halfSpectrum: boolean, only the positive ranges
+    :param method: string, angle estimator
+    :param keepCubes: boolean, also return the radar cube of every scenario
+    :param chunkSize: integer, scenarios sent to a worker at once
+    :param seed: integer, seed of the noise, the same seed gives the same
+        results for any number of workers
+    :param integration: string, see integration.integrateChannels
+    :param beams: steering angle or angles, see integration.integrateChannels
+    :param detectorOptions: see detector.detectTargets
+    :return dict of numpy.array columns (see SUMMARY) and, with keepCubes, 
+        the SweepCubes of shape (scenarios, channels, chirps, range bins),
+        to be closed by the caller
+    """
+    options = {"closedForm": closedForm, "halfSpectrum": halfSpectrum, \
+        "method": method, "seed": seed, "integration": integration, \
+        "beams": beams, "detector": detectorOptions}
+    memory = None
+    complexType = radarConfig(radar).complexType
+    if keepCubes:
+        shape = (len(scenarios),) + cubeShape(radar, halfSpectrum)
+        memory = shared_memory.SharedMemory(create=True, \
+            size=max(1, complexType().itemsize * prod(shape)))
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=sweepInitializer, \
+            initargs=(radar, options, memory and memory.name, \
+            len(scenarios))) as pool:
+            rows = list(pool.map(sweepScenario, enumerate(scenarios), \
+                chunksize=chunkSize))
+    except BaseException:
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+        raise
+    rows = concatenate(rows) if rows else zeros(0, dtype=SUMMARY)
+    summary = {name: rows[name] for name, _ in SUMMARY}
+    if not keepCubes:
+        return summary
+    # The cubes stay in the shared memory the workers wrote them into
+    return summary, SweepCubes(memory, shape, complexType)
+
+def test_runSweep():
+    # Sweep the first target over range and angle on all the cores
+    scenarios = scenarioGrid(ENVIRONMENT, 1, ranges=[50, 100, 200], \
+        angles=[-30, 0, 30])
+    summary = runSweep(RADAR, scenarios, \
+        maxTargets=ENVIRONMENT["Total Targets"])
+    for iRow in range(summary["scenario"].size):
+        print("Scenario {}: {:.1f}m, {:.1f}m/s, {:.1f} degrees".format( \
+            summary["scenario"][iRow], summary["rangeMeters"][iRow], \
+            summary["velocity"][iRow], summary["angle"][iRow]))
+
+    # Every scenario detects the swept target where it was placed, within a
+    # range bin and a degree
+    radar = radarConfig(RADAR)
+    for iScenario, scenario in enumerate(scenarios):
+        targetRange, targetVelocity, targetAngle = scenario["Target 1"]
+        rows = summary["scenario"] == iScenario
+        assert rows.sum() == ENVIRONMENT["Total Targets"]
+        assert ((abs(summary["rangeMeters"][rows] - targetRange) <= \
+            radar.rangeBin) & (abs(summary["angle"][rows] - targetAngle) <= \
+            1) & (abs(summary["velocity"][rows] - targetVelocity) <= \
+            radar.velocityBin)).any()
+
+    # Keep the radar cubes in the shared memory of the sweep
+    summary, cubes = runSweep(RADAR, scenarios[:3], keepCubes=True, \
+        maxTargets=1)
+    with cubes:
+        print("Cubes {}, peak of the first: {:.2e}".format(cubes.cubes.shape, \
+            abs(cubes[0]).max()))
+
+def test_reproducibleSweep():
+    # Two seeded sweeps on two workers give the same cubes, whichever
+    # worker draws the noise of a scenario
+    scenarios = scenarioGrid(ENVIRONMENT, 1, ranges=[50, 100], \
+        angles=[-30, 0, 30])
+    _, cubes = runSweep(RADAR, scenarios, workers=2, seed=0, keepCubes=True)
+    with cubes:
+        _, rerunCubes = runSweep(RADAR, scenarios, workers=2, seed=0, \
+            keepCubes=True)
+        with rerunCubes:
+            assert array_equal(cubes.cubes, rerunCubes.cubes)
+            print("Reproducible cubes {}".format(cubes.cubes.shape))
+
+# Run this file to sweep a few scenarios over all the cores
+if __name__ == '__main__':
+    test_runSweep()
+    test_reproducibleSweep()
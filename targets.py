@@ -0,0 +1,212 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Targets Module
+# The targets of a scene as one array per property (range, velocity, angle
+# and radar cross section) instead of one "Target N" entry per target, so
+# scenes of many thousands of scatterers can be synthesized. The tables are
+# loaded from the ENVIRONMENT dicts of test_config, CSV or NPZ files and are
+# processed in chunks of targets that fit in the cache.
+
+from scipy.constants import c
+from numpy import asarray, atleast_1d, broadcast_arrays, genfromtxt, savez, \
+    savetxt, column_stack, load, concatenate, random
+
+# Radar cross section of the targets of the dict scenes, the power constant
+# that RadarTarget uses
+DEFAULT_RCS = 10
+
+# Bytes of the intermediate arrays of one chunk of targets, about the size of
+# the last level cache. Smaller chunks fit a lower level but make the 
+# products over the targets too thin to run fast.
+chunkBytes = 2 ** 23
+
+class TargetTable():
+    """
+    TargetTable class holds the targets of a scene, one array per property.
+    """
+
+    __slots__ = ("range", "velocity", "angle", "rcs", "fractional")
+
+    def __init__(self, range, velocity, angle, rcs=DEFAULT_RCS, \
+        fractional=False):
+        """
+        TargetTable object constructor
+        :param range: numpy.array, in meters, must be positive
+        :param velocity: numpy.array, positive for approaching targets
+        :param angle: numpy.array, in degrees
+        :param rcs: numpy.array or float, radar cross section (the power 
+            constant of the attenuation)
+        :param fractional: boolean, use the sub sample delay model, see
+            environment.RadarTarget
+        """
+        self.range, self.velocity, self.angle, self.rcs = (atleast_1d( \
+            asarray(values, dtype=float)) for values in broadcast_arrays( \
+            range, velocity, angle, rcs))
+        self.fractional = fractional
+
+    @classmethod
+    def fromEnvironment(cls, environment):
+        """
+        This function creates the table of an ENVIRONMENT dict, the targets
+        are [range, velocity, angle] or [range, velocity, angle, rcs]
+        :param environment: dict
+        :return TargetTable
+        """
+        targets = [list(environment["Target " + str(iTarget + 1)]) + \
+            [DEFAULT_RCS] for iTarget in range(environment["Total Targets"])]
+        columns = asarray([target[:4] for target in targets], dtype=float) \
+            .reshape((-1, 4))
+        return cls(*columns.T, environment.get("Fractional Delay", False))
+
+    @classmethod
+    def fromCSV(cls, fileName, fractional=False):
+        """
+        This function loads a table from a CSV file with a header row and
+        the columns range, velocity, angle and optionally rcs
+        :param fileName: string
+        :param fractional: boolean
+        :return TargetTable
+        """
+        columns = atleast_1d(genfromtxt(fileName, delimiter=",", names=True))
+        rcs = columns["rcs"] if "rcs" in columns.dtype.names else DEFAULT_RCS
+        return cls(columns["range"], columns["velocity"], columns["angle"], \
+            rcs, fractional)
+
+    @classmethod
+    def fromNPZ(cls, fileName, fractional=False):
+        """
+        This function loads a table from an NPZ file with the arrays range,
+        velocity, angle and optionally rcs
+        :param fileName: string
+        :param fractional: boolean
+        :return TargetTable
+        """
+        with load(fileName) as columns:
+            rcs = columns["rcs"] if "rcs" in columns else DEFAULT_RCS
+            return cls(columns["range"], columns["velocity"], \
+                columns["angle"], rcs, fractional)
+
+    def saveCSV(self, fileName):
+        savetxt(fileName, column_stack((self.range, self.velocity, \
+            self.angle, self.rcs)), delimiter=",", \
+            header="range,velocity,angle,rcs", comments="")
+
+    def saveNPZ(self, fileName):
+        savez(fileName, range=self.range, velocity=self.velocity, \
+            angle=self.angle, rcs=self.rcs)
+
+    def toEnvironment(self):
+        """
+        This function returns the table as an ENVIRONMENT dict
+        :return dict
+        """
+        environment = {"Total Targets": len(self)}
+        for iTarget in range(len(self)):
+            environment["Target " + str(iTarget + 1)] = [ \
+                float(self.range[iTarget]), float(self.velocity[iTarget]), \
+                float(self.angle[iTarget]), float(self.rcs[iTarget])]
+        if self.fractional:
+            environment["Fractional Delay"] = True
+        return environment
+
+    def __len__(self):
+        return self.range.size
+
+    def __getitem__(self, index):
+        """
+        Indexing the table selects targets, slices are views of the table
+        """
+        return TargetTable(self.range[index], self.velocity[index], \
+            self.angle[index], self.rcs[index], self.fractional)
+
+    def chunks(self, size):
+        """
+        This function yields the table in chunks of targets
+        :param size: integer, targets per chunk
+        :return generator of TargetTable
+        """
+        for first in range(0, len(self), size):
+            yield self[first:first + size]
+
+    def moved(self, time):
+        """
+        This function returns the table after the targets moved at their
+        velocity for the given time
+        :param time: float
+        :return TargetTable
+        """
+        return TargetTable(self.range - self.velocity * time, self.velocity, \
+            self.angle, self.rcs, self.fractional)
+
+    @property
+    def delay(self):
+        """Round trip time of every target"""
+        return (self.range * 2) / c
+
+    @property
+    def attenuation(self):
+        """Amplitude of the echo of every target due to the propagation"""
+        return self.rcs / (self.range ** 4)
+
+def targetTable(scene):
+    """
+    This function returns the TargetTable of a scene
+    :param scene: TargetTable, ENVIRONMENT dict or the name of a CSV or NPZ
+        file
+    :return TargetTable
+    """
+    if isinstance(scene, TargetTable):
+        return scene
+    if isinstance(scene, dict):
+        return TargetTable.fromEnvironment(scene)
+    if str(scene).lower().endswith(".npz"):
+        return TargetTable.fromNPZ(scene)
+    return TargetTable.fromCSV(scene)
+
+def chunkSize(bytesPerTarget):
+    """
+    This function returns how many targets are processed together so the
+    intermediate arrays of a chunk take about chunkBytes
+    :param bytesPerTarget: integer
+    :return integer
+    """
+    return max(1, chunkBytes // bytesPerTarget)
+
+def clutterScene(totalTargets, ranges, maxVelocity=0.5, angles=(-60, 60), \
+    rcs=(1e-4, 1e-2), seed=None):
+    """
+    This function creates a scene of random scatterers (e.g. ground clutter)
+    :param totalTargets: integer
+    :param ranges: tuple, smallest and largest range in meters
+    :param maxVelocity: float, largest speed of the scatterers
+    :param angles: tuple, smallest and largest angle in degrees
+    :param rcs: tuple, smallest and largest radar cross section
+    :param seed: integer
+    :return TargetTable
+    """
+    generator = random.default_rng(seed)
+    return TargetTable(generator.uniform(ranges[0], ranges[1], totalTargets), \
+        generator.uniform(-maxVelocity, maxVelocity, totalTargets), \
+        generator.uniform(angles[0], angles[1], totalTargets), \
+        generator.uniform(rcs[0], rcs[1], totalTargets))
+
+def concatenateTables(tables):
+    """
+    This function joins the targets of several tables, they must all use
+    the same delay model
+    :param tables: list of TargetTable
+    :return TargetTable
+    """
+    fractional = set(table.fractional for table in tables)
+    if len(fractional) > 1:
+        raise ValueError("Tables with and without the fractional delay " \
+            "model cannot be joined")
+    return TargetTable(*(concatenate([getattr(table, name) for table in \
+        tables]) for name in ("range", "velocity", "angle", "rcs")), \
+        fractional.pop() if fractional else False)
@@ -23,7 +23,12 @@ RADAR = {
     "Antenna Gain" : 1,
     "Noise Figure": 1e9,
     "Array Size": 10,
-    "Array Spacing": 0.5
+    "Array Spacing": 0.5,
+    "Range Window": "Hann",
+    "Doppler Window": "Hann",
+    "Chebyshev Attenuation": 60,
+    "IQ Transmitter": False,
+    "Precision": "Double"
 }
 
 ENVIRONMENT = {
@@ -0,0 +1,365 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Tracker Module
+# It follows the detections over the frames with Kalman filters of constant
+# acceleration in range and velocity and constant angular rate in angle, the
+# range changes with minus the velocity (positive is approaching). The tracks are not objects: their
+# states and covariances are stacked arrays, so all of them are predicted, 
+# gated and updated with a few matrix operations per frame. Detections are
+# associated to the tracks with the Hungarian algorithm or greedily to the
+# nearest one, inside a gate on the Mahalanobis distance.
+
+from numpy import array, zeros, ones, eye, empty, full, arange, outer, \
+    concatenate, column_stack, einsum, argsort, argmin, unravel_index, \
+    isfinite, where, searchsorted, repeat, cumsum, sqrt, inf, random, int32, \
+    int64, float64
+from numpy.linalg import inv
+from time import perf_counter
+from scipy.optimize import linear_sum_assignment
+from test_config import RADAR
+from configuration import radarConfig
+from common import rangeAxis, velocityAxis
+from instrumentation import instrument
+
+# Compact description of every track, see Tracker.tracks
+TRACK = [("identity", int64), ("range", float64), ("velocity", float64), \
+    ("angle", float64), ("hits", int32), ("misses", int32)]
+
+# The state of a track is (range, velocity, acceleration, angle, angular 
+# rate), the measurement is (range, velocity, angle). The range rate is minus
+# the velocity, so it is not a state of its own.
+MEASURED = [0, 1, 3]
+
+# Mahalanobis distance (squared) that keeps 99% of the measurements of a 
+# track, chi-square with 3 degrees of freedom
+DEFAULT_GATE = 11.34
+
+def transitionMatrix(frameTime):
+    """
+    This function returns the state transition over one frame at constant
+    acceleration and angular rate, the range moves by minus the velocity
+    :param frameTime: float
+    :return numpy.array of shape (5, 5)
+    """
+    transition = eye(5)
+    transition[0, 1] = -frameTime
+    transition[0, 2] = -frameTime ** 2 / 2
+    transition[1, 2] = frameTime
+    transition[3, 4] = frameTime
+    return transition
+
+def processCovariance(frameTime, processNoise):
+    """
+    This function returns the covariance of the random (white) acceleration
+    of the state over one frame
+    :param frameTime: float
+    :param processNoise: tuple, spectral density of the range acceleration
+        the velocity does not follow, of the velocity acceleration rate and 
+        of the angular acceleration
+    :return numpy.array of shape (5, 5)
+    """
+    rangeDensity, velocityDensity, angleDensity = processNoise
+    covariance = zeros((5, 5))
+    # Range, velocity and acceleration driven by one white acceleration
+    # rate, the range is minus the integral of the velocity
+    sign = array([-1, 1, 1])
+    covariance[:3, :3] = velocityDensity * outer(sign, sign) * array([ \
+        [frameTime ** 5 / 20, frameTime ** 4 / 8, frameTime ** 3 / 6], \
+        [frameTime ** 4 / 8, frameTime ** 3 / 3, frameTime ** 2 / 2], \
+        [frameTime ** 3 / 6, frameTime ** 2 / 2, frameTime]])
+    covariance[0, 0] += rangeDensity * frameTime ** 3 / 3
+    covariance[3:, 3:] = angleDensity * array([[frameTime ** 3 / 3, \
+        frameTime ** 2 / 2], [frameTime ** 2 / 2, frameTime]])
+    return covariance
+
+def detectionMeasurements(radar, detections, angles, halfSpectrum=True, \
+    axes=None):
+    """
+    This function converts the detections of a frame into measurements
+    :param radar: dict
+    :param detections: numpy.array of type detector.DETECTION
+    :param angles: numpy.array, angle of every detection in degrees
+    :param halfSpectrum: boolean, see receiver.rangeDopplerFFT
+    :param axes: tuple, range and velocity axes of a region cube (see 
+        region.regionAxes) instead of the whole cube
+    :return numpy.array of shape (detections, 3), range, velocity and angle
+    """
+    if axes is None:
+        axes = (rangeAxis(radar, halfSpectrum), velocityAxis(radar))
+    return column_stack((axes[0][detections["range"]], \
+        axes[1][detections["doppler"]], angles)).astype(float64)
+
+def greedyAssignment(distance):
+    """
+    This function pairs the tracks and detections from the closest pair to
+    the farthest, every track and detection is used at most once
+    :param distance: numpy.array of shape (tracks, detections), inf outside
+        of the gate
+    :return numpy.array, tracks, and numpy.array, detections
+    """
+    order = argsort(distance, axis=None)
+    order = order[isfinite(distance.ravel()[order])]
+    trackIndex, detectionIndex = unravel_index(order, distance.shape)
+    usedTracks = zeros(distance.shape[0], dtype=bool)
+    usedDetections = zeros(distance.shape[1], dtype=bool)
+    keep = zeros(order.size, dtype=bool)
+    for iPair, (iTrack, iDetection) in enumerate(zip(trackIndex.tolist(), \
+        detectionIndex.tolist())):
+        if not usedTracks[iTrack] and not usedDetections[iDetection]:
+            usedTracks[iTrack] = usedDetections[iDetection] = True
+            keep[iPair] = True
+    return trackIndex[keep], detectionIndex[keep]
+
+def hungarianAssignment(distance):
+    """
+    This function pairs the tracks and detections with the smallest total
+    distance (Hungarian algorithm), pairs outside the gate are dropped
+    :param distance: numpy.array of shape (tracks, detections), inf outside
+        of the gate
+    :return numpy.array, tracks, and numpy.array, detections
+    """
+    gated = isfinite(distance)
+    # The solver needs finite costs, anything outside the gate costs more
+    # than every possible assignment inside of it
+    cost = where(gated, distance, distance[gated].sum() + 1 if gated.any() \
+        else 1)
+    trackIndex, detectionIndex = linear_sum_assignment(cost)
+    keep = gated[trackIndex, detectionIndex]
+    return trackIndex[keep], detectionIndex[keep]
+
+ASSIGNMENTS = {"Hungarian": hungarianAssignment, "Nearest": greedyAssignment}
+
+class Tracker():
+    """
+    Tracker class holds the tracks of a scene as stacked Kalman filters.
+    """
+
+    __slots__ = ("transition", "processCovariance", "measurementCovariance", \
+        "gate", "assignment", "confirmHits", "maxMisses", "state", \
+        "initialRates", "covariance", "identity", "hits", "misses", \
+        "nextIdentity")
+
+    def __init__(self, radar, frameTime=None, processNoise=(1.0, 1.0, 10.0), \
+        measurementNoise=None, gate=DEFAULT_GATE, assignment="Hungarian", \
+        confirmHits=3, maxMisses=2, initialRates=(5.0, 10.0)):
+        """
+        Tracker object constructor
+        :param radar: dict
+        :param frameTime: float, time between the frames, one frame of chirps
+            by default
+        :param processNoise: tuple, spectral densities of range, velocity 
+            and angle, see processCovariance
+        :param measurementNoise: tuple, standard deviation of the measured 
+            range, velocity and angle, half a bin and 1 degree by default
+        :param gate: float, largest squared Mahalanobis distance of a 
+            detection to its track
+        :param assignment: string, "Hungarian" or "Nearest"
+        :param confirmHits: integer, detections (including the first one)
+            before a track is reported
+        :param maxMisses: integer, frames in a row without a detection before
+            a track is deleted
+        :param initialRates: tuple, standard deviation of the acceleration
+            (m/s^2) and of the angular rate (degrees/s) of a new track
+        """
+        radar = radarConfig(radar)
+        if frameTime is None:
+            frameTime = radar.chirpTime * radar.frameChirps
+        if measurementNoise is None:
+            measurementNoise = (radar.rangeBin / 2, radar.velocityBin / 2, 1.0)
+        if assignment not in ASSIGNMENTS:
+            raise ValueError("Assignment must be one of " + \
+                str(list(ASSIGNMENTS)))
+        self.transition = transitionMatrix(frameTime)
+        self.processCovariance = processCovariance(frameTime, processNoise)
+        self.measurementCovariance = eye(3) * [value ** 2 for value in \
+            measurementNoise]
+        self.gate = gate
+        self.assignment = assignment
+        self.confirmHits = confirmHits
+        self.maxMisses = maxMisses
+        self.initialRates = initialRates
+        self.state = empty((0, 5))
+        self.covariance = empty((0, 5, 5))
+        self.identity = empty(0, dtype=int64)
+        self.hits = empty(0, dtype=int32)
+        self.misses = empty(0, dtype=int32)
+        self.nextIdentity = 0
+
+    def __len__(self):
+        return self.identity.size
+
+    def predict(self):
+        """
+        This function moves all the tracks forward by one frame
+        """
+        self.state = self.state @ self.transition.T
+        self.covariance = self.transition @ self.covariance @ \
+            self.transition.T + self.processCovariance
+
+    def distances(self, measurements):
+        """
+        This function returns the squared Mahalanobis distance of every
+        measurement to every track, inf outside of the gate, with the
+        inverse of the innovation covariance of every track
+        :param measurements: numpy.array of shape (detections, 3)
+        :return numpy.array of shape (tracks, detections) and numpy.array of
+            shape (tracks, 3, 3)
+        """
+        innovationCovariance = self.covariance[:, MEASURED][:, :, MEASURED] \
+            + self.measurementCovariance
+        inverse = inv(innovationCovariance)
+        distance = full((len(self), measurements.shape[0]), inf)
+
+        # A measurement outside the gate in range alone is outside the gate,
+        # so only the measurements in the range window of every track are 
+        # candidates. They are found on the sorted ranges.
+        order = argsort(measurements[:, 0])
+        sortedRange = measurements[order, 0]
+        halfWindow = sqrt(self.gate * innovationCovariance[:, 0, 0])
+        first = searchsorted(sortedRange, self.state[:, 0] - halfWindow)
+        counts = searchsorted(sortedRange, self.state[:, 0] + halfWindow, \
+            side="right") - first
+        trackIndex = repeat(arange(len(self)), counts)
+        detectionIndex = order[arange(counts.sum()) + repeat(first - \
+            cumsum(counts) + counts, counts)]
+
+        # Distance of the candidate pairs
+        innovation = measurements[detectionIndex] - \
+            self.state[trackIndex][:, MEASURED]
+        pairDistance = einsum("pi,pij,pj->p", innovation, \
+            inverse[trackIndex], innovation)
+        inside = pairDistance <= self.gate
+        distance[trackIndex[inside], detectionIndex[inside]] = \
+            pairDistance[inside]
+        return distance, inverse
+
+    def correct(self, tracks, measurements, inverse):
+        """
+        This function updates the tracks with their associated measurements
+        :param tracks: numpy.array, index of the updated tracks
+        :param measurements: numpy.array of shape (tracks, 3)
+        :param inverse: numpy.array of shape (tracks, 3, 3), inverse of the
+            innovation covariance of the updated tracks
+        """
+        covariance = self.covariance[tracks]
+        # Kalman gain of every track: P H' S^-1
+        gain = covariance[:, :, MEASURED] @ inverse
+        innovation = measurements - self.state[tracks][:, MEASURED]
+        self.state[tracks] += einsum("tij,tj->ti", gain, innovation)
+        self.covariance[tracks] = covariance - gain @ covariance[:, MEASURED]
+
+    def initiate(self, measurements):
+        """
+        This function starts a track on every measurement. The acceleration
+        and the angular rate start at zero.
+        :param measurements: numpy.array of shape (detections, 3)
+        """
+        total = measurements.shape[0]
+        state = zeros((total, 5))
+        state[:, MEASURED] = measurements
+        covariance = zeros((total, 5, 5))
+        noise = self.measurementCovariance.diagonal()
+        covariance[:, MEASURED, MEASURED] = noise
+        # The rates are not measured, they start with their own prior
+        covariance[:, 2, 2] = self.initialRates[0] ** 2
+        covariance[:, 4, 4] = self.initialRates[1] ** 2
+        self.state = concatenate((self.state, state))
+        self.covariance = concatenate((self.covariance, covariance))
+        self.identity = concatenate((self.identity, self.nextIdentity + \
+            arange(total)))
+        self.hits = concatenate((self.hits, ones(total, dtype=int32)))
+        self.misses = concatenate((self.misses, zeros(total, dtype=int32)))
+        self.nextIdentity += total
+
+    @instrument("tracking")
+    def update(self, measurements):
+        """
+        This function runs one frame of the tracker: predict the tracks,
+        associate the measurements, update the matched tracks, delete the
+        lost ones and start new tracks on the unmatched measurements
+        :param measurements: numpy.array of shape (detections, 3), see
+            detectionMeasurements
+        :return numpy.array of type TRACK, the confirmed tracks
+        """
+        self.predict()
+        distance, inverse = self.distances(measurements)
+        trackIndex, detectionIndex = ASSIGNMENTS[self.assignment](distance)
+        self.correct(trackIndex, measurements[detectionIndex], \
+            inverse[trackIndex])
+
+        # Counting the hits and misses of every track
+        matched = zeros(len(self), dtype=bool)
+        matched[trackIndex] = True
+        self.hits[matched] += 1
+        self.misses[matched] = 0
+        self.misses[~matched] += 1
+        keep = self.misses <= self.maxMisses
+        # Tentative tracks are deleted with their first miss
+        keep &= (self.hits >= self.confirmHits) | matched
+        for name in ("state", "covariance", "identity", "hits", "misses"):
+            setattr(self, name, getattr(self, name)[keep])
+
+        unmatched = ones(measurements.shape[0], dtype=bool)
+        unmatched[detectionIndex] = False
+        self.initiate(measurements[unmatched])
+        return self.tracks()
+
+    def tracks(self, confirmed=True):
+        """
+        This function returns the tracks
+        :param confirmed: boolean, only the confirmed tracks
+        :return numpy.array of type TRACK
+        """
+        select = self.hits >= (self.confirmHits if confirmed else 0)
+        tracks = empty(select.sum(), dtype=TRACK)
+        tracks["identity"] = self.identity[select]
+        tracks["range"] = self.state[select, 0]
+        tracks["velocity"] = self.state[select, 1]
+        tracks["angle"] = self.state[select, 3]
+        tracks["hits"] = self.hits[select]
+        tracks["misses"] = self.misses[select]
+        return tracks
+
+def test_tracker():
+    # Track a few hundred targets moving at constant velocity from noisy and
+    # incomplete measurements, and time the frames
+    generator = random.default_rng(0)
+    totalTargets = 300
+    frameTime = 0.05
+    ranges = generator.uniform(20, 240, totalTargets)
+    velocities = generator.uniform(-20, 20, totalTargets)
+    angles = generator.uniform(-60, 60, totalTargets)
+    noise = (0.3, 0.05, 1.0)
+    tracker = Tracker(RADAR, frameTime)
+    for iFrame in range(20):
+        truth = column_stack((ranges - velocities * frameTime * iFrame, \
+            velocities, angles))
+        measurements = truth + generator.normal(0, noise, (totalTargets, 3))
+        # Every target is missed one frame in ten
+        measurements = measurements[generator.random(totalTargets) > 0.1]
+        start = perf_counter()
+        tracks = tracker.update(measurements)
+        print("Frame {}: {} confirmed tracks of {} in {:.2f}ms".format(iFrame, \
+            tracks.size, len(tracker), 1e3 * (perf_counter() - start)))
+
+    # Every track is compared with its closest target, the tracks are more
+    # accurate in range and velocity than the detections
+    estimates = column_stack((tracks["range"], tracks["velocity"], \
+        tracks["angle"]))
+    closest = argmin(((((estimates[:, None] - truth[None]) / noise) ** 2) \
+        .sum(axis=-1)), axis=1)
+    trackError = sqrt(((estimates - truth[closest]) ** 2).mean(axis=0))
+    print("RMS error of the tracks: {:.3f}m, {:.3f}m/s, detections: {:.3f}m, "
+        "{:.3f}m/s".format(trackError[0], trackError[1], *noise[:2]))
+    assert tracks.size >= 0.95 * totalTargets
+    assert trackError[0] < 0.5 * noise[0] and trackError[1] < 0.75 * noise[1]
+
+# Run this file to track a few hundred synthetic targets
+if __name__ == '__main__':
+    test_tracker()
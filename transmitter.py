@@ -12,37 +12,68 @@
 # waveforms generated and their frequency spectrums.
 
 from math import pi
-import matplotlib.pyplot as plot
-from numpy import tile, linspace, exp
-from common import powerSpectrum, phaseSpectrum
+from collections import OrderedDict
+from numpy import linspace, exp, broadcast_to
 from test_config import RADAR
+from configuration import radarConfig
+from instrumentation import instrument, event, addSink, PrintSink
+from visualization import signalFigure, finishFigure
 
+# Waveforms already generated, the least recently used ones are dropped when
+# they take more than waveformBankLimit bytes
+waveformBank = OrderedDict()
+waveformBankLimit = 64 * 2 ** 20
+
+def cachedWaveform(key, generator):
+    """
+    This function returns the waveform of the given key from the waveform
+    bank, generating it only if it is not there. The waveform is read only.
+    :param key: tuple, the parameters of the waveform
+    :param generator: function that returns the waveform
+    :return numpy.array
+    """
+    if key in waveformBank:
+        waveformBank.move_to_end(key)
+        return waveformBank[key]
+    waveform = generator()
+    waveform.flags.writeable = False
+    waveformBank[key] = waveform
+    # Drop the least recently used waveforms, but never the new one
+    while len(waveformBank) > 1 and \
+        sum(item.nbytes for item in waveformBank.values()) > waveformBankLimit:
+        waveformBank.popitem(last=False)
+    return waveform
+
+@instrument("transmit")
 def chirpGenerator(RADAR, log):
     """ 
     This function generates an LFM chirp based on the give RADAR configuration 
-    file. 
-    :param RADAR: dict
-    :param log: boolean
-    :return: numpy.array
+    file. The configuration is validated (including the nyguist criteria) 
+    when it is converted to a RadarConfig. With "IQ Transmitter" the complex
+    chirp exp(-j pi B t^2 / T) is returned, so that mixing the echo with its
+    conjugate gives a positive beat frequency for every target. Its real part
+    is the same chirp as the real transmitter.
+    :param RADAR: dict or RadarConfig
+    :param log: boolean, send the sample times to the instrumentation sinks
+    :return: numpy.array, read only and shared by all the calls with the 
+        same chirp parameters
     """
-
-    # Calculate the sampling frequency required
-    maxSamplingTime = 1 / (2 * RADAR["Chirp Bandwidth"])
-    # Create the time axis for the calculation of the signal
-    time = linspace(0, RADAR["Chirp Time"], RADAR["Time Samples in Chirp"])
-    # Check if nyguist criteria is met using the given time samples
-    if time[1] < maxSamplingTime:
-        raise ValueError("For the given chirp the smallest sampling time is " \
-            + str(maxSamplingTime) + ". Please configure the Chirp correctly")
-    # Print the log if requested
-    elif (log):
-        print('Nyguist Sample time: {:.2e}'.format(maxSamplingTime))
-        print('Radar Bandwidth: {:.2e}'.format(RADAR["Chirp Bandwidth"]))
-        print('Current Sample Time: {:.2e}'.format(time[1]))
-    # Creating the complex signal which can then be transformed
-    chirpSignal = exp((1j * pi * RADAR["Chirp Bandwidth"] * time * time) /\
-        RADAR["Chirp Time"])
-    return chirpSignal.real
+    radar = radarConfig(RADAR)
+    # Record the sample times if requested
+    if (log):
+        event("transmit", nyguistSampleTime=1 / (2 * radar.chirpBandwidth), \
+            chirpBandwidth=radar.chirpBandwidth, sampleTime=radar.sampleTime)
+    def generator():
+        # Create the time axis for the calculation of the signal
+        time = radar.timeAxis
+        # Creating the complex signal which can then be transformed
+        chirpSignal = exp((-1j * pi * radar.chirpBandwidth * time * time) /\
+            radar.chirpTime)
+        if radar.iqTransmitter:
+            return chirpSignal.astype(radar.complexType)
+        return chirpSignal.real.astype(radar.realType)
+    return cachedWaveform(("chirp", radar.chirpBandwidth, radar.chirpTime, \
+        radar.totalSamples, radar.iqTransmitter, radar.precision), generator)
 
 def test_chirpGenerator():
     # Generate the time axis for plotting the signal
@@ -54,42 +85,40 @@ def test_chirpGenerator():
     transmitChirp = chirpGenerator(RADAR, True)
 
     # Plotting the results
-    fig = plot.figure()
-    title = "Transmit Chirp"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    timePlot = plot.subplot(211)
-    timePlot.plot(time, transmitChirp)
-    timePlot.title.set_text('Time Domain')
-    timePlot.grid()
-
-    frequencyPlot = plot.subplot(223)
-    frequencyPlot.plot(frequency / 1e6, powerSpectrum(transmitChirp))
-    frequencyPlot.title.set_text('Frequency Domain: Amplitude')
-    frequencyPlot.grid()
-
-    anglePlot = plot.subplot(224)
-    anglePlot.plot(frequency / 1e6, phaseSpectrum(transmitChirp))
-    anglePlot.title.set_text('Frequency Domain: Phase')
-    anglePlot.grid()
-
-    plot.show()
+    finishFigure(signalFigure("Transmit Chirp", time, transmitChirp, \
+        frequency))
 
+@instrument("transmit")
 def sequenceGenerator(radar, chirpSignal, log):
     """ 
     This function repeats in the input chirpbased on the give RADAR 
-    configuration file to create a sequence. 
+    configuration file to create a sequence. The transmitters of a TDM MIMO
+    radar take turns, so the sequence has the chirps of all of them, see 
+    transmitSlots.
     :param  RADAR: dict
     :param  chirpSignal: numpy.array
-    :param  log: boolean
-    :return: numpy.array
+    :param  log: boolean, send the sequence length to the instrumentation
+        sinks
+    :return: numpy.array of shape (chirps, samples), a read only view of the
+        chirp that does not copy it
     """
+    radar = radarConfig(radar)
 
     # Returns the same input chirp signal repeated multiples times
     if log:
-        print('Creating a chirp sequence of length: {}'\
-            .format(radar["Number of Chirps"]))
-    return tile(chirpSignal, radar["Number of Chirps"])
+        event("transmit", sequenceLength=radar.frameChirps, \
+            transmitters=radar.totalTransmitters)
+    return broadcast_to(chirpSignal, (radar.frameChirps, chirpSignal.size))
+
+def transmitSlots(radar, chirpIndex):
+    """
+    This function returns the transmitter that sends every chirp of the
+    frame, the transmitters take turns one chirp each
+    :param radar: dict
+    :param chirpIndex: numpy.array, index of the chirps in the frame
+    :return numpy.array
+    """
+    return chirpIndex % radarConfig(radar).totalTransmitters
 
 def test_sequenceGenerator():
     # Generate the time axis for plotting the signal
@@ -105,30 +134,14 @@ def test_sequenceGenerator():
     # Generate the chirp sequence from the sequenceGenerator
     transmitSequence = sequenceGenerator(RADAR, transmitChirp, True)
 
-    # Plotting the results
-    fig = plot.figure()
-    title = "Transmit Sequence"
-    fig.suptitle(title, fontsize=20, weight=50)
-
-    timePlot = plot.subplot(211)
-    timePlot.plot(time, transmitSequence)
-    timePlot.title.set_text('Time Domain')
-    timePlot.grid()
-
-    frequencyPlot = plot.subplot(223)
-    frequencyPlot.plot(frequency / 1e6, powerSpectrum(transmitSequence))
-    frequencyPlot.title.set_text('Frequency Domain: Amplitude')
-    frequencyPlot.grid()
-
-    anglePlot = plot.subplot(224)
-    anglePlot.plot(frequency / 1e6, phaseSpectrum(transmitSequence))
-    anglePlot.title.set_text('Frequency Domain: Phase')
-    anglePlot.grid()
-
-    plot.show()
+    # Plotting the results, the spectrum is the one of a single chirp
+    finishFigure(signalFigure("Transmit Sequence", time, \
+        transmitSequence.ravel(), frequency, transmitSequence[0]))
 
 # Run this file to test the functions by examining the time and frequency 
 # domain representations of the chirp and the chirp sequence
 if __name__ == '__main__':
+    # Print the logs and the records of the stages
+    addSink(PrintSink())
     test_chirpGenerator()
     test_sequenceGenerator()
\ No newline at end of file
@@ -0,0 +1,254 @@
+# oooo    oooo                                          
+# `888   .8P'                                          Karan Jayachandra
+#  888  d8'     .oooo.   oooo d8b  .oooo.   ooo. .oo.  mail@karanjayachandra.com
+#  88888[      `P  )88b  `888""8P `P  )88b  `888P"Y88b karanjayachandra.com
+#  888`88b.     .oP"888   888      .oP"888   888   888 
+#  888  `88b.  d8(  888   888     d8(  888   888   888 
+# o888o  o888o `Y888""8o d888b    `Y888""8o o888o o888o 
+
+# FMCW Visualization Module
+# It only draws results that were already calculated, the test functions of
+# the other modules compute and then call it. Long signals are drawn as
+# their min/max envelope, the spectra of the read only waveforms are cached
+# and range doppler maps are streamed into one image. Nothing blocks when
+# there is no display (Agg backend) or when a figure is saved to a file.
+
+from math import pi
+from collections import OrderedDict
+import matplotlib.pyplot as plot
+from numpy import asarray, arange, empty, pad, abs, angle, log, log10, \
+    transpose
+from numpy.fft import fft, fftshift
+from configuration import radarConfig
+
+# Backends that can not show a window
+HEADLESS_BACKENDS = ("agg", "pdf", "pgf", "ps", "svg", "cairo", "template")
+
+# Spectra of read only signals, the least recently used ones are dropped
+spectrumCache = OrderedDict()
+spectrumCacheSize = 32
+
+def headless():
+    """
+    This function switches to the Agg backend, figures are then only saved
+    """
+    plot.switch_backend("Agg")
+
+def interactive():
+    """
+    This function returns if the figures can be shown in a window
+    :return boolean
+    """
+    return plot.get_backend().lower() not in HEADLESS_BACKENDS
+
+def finishFigure(figure, fileName=None, block=True):
+    """
+    This function saves the figure to a file or shows it. Without a display
+    the figure is only closed, so batch runs never wait on a window.
+    :param figure: matplotlib.figure.Figure
+    :param fileName: string, save instead of showing
+    :param block: boolean, wait for the window to be closed
+    """
+    if fileName is not None:
+        figure.savefig(fileName)
+    elif interactive():
+        plot.show(block=block)
+        return
+    plot.close(figure)
+
+def envelope(values, axis=None, maxPoints=4096):
+    """
+    This function decimates a long signal to the minimum and the maximum of
+    every group of samples, which draws the same as all the samples
+    :param values: numpy.array, real
+    :param axis: numpy.array, x values, the sample index by default
+    :param maxPoints: integer, points that are drawn at most
+    :return numpy.array, numpy.array: x and y of the points to draw
+    """
+    values = asarray(values)
+    axis = arange(values.size) if axis is None else asarray(axis)
+    if values.size <= maxPoints:
+        return axis, values
+    # Groups of equal size, the last one is padded with its last sample
+    groupSize = -(-values.size // (maxPoints // 2))
+    groups = -(-values.size // groupSize)
+    padding = (0, groups * groupSize - values.size)
+    values = pad(values, padding, mode="edge").reshape((groups, groupSize))
+    axis = pad(axis, padding, mode="edge").reshape((groups, groupSize))
+    decimatedAxis = empty(2 * groups, dtype=axis.dtype)
+    decimatedValues = empty(2 * groups, dtype=values.dtype)
+    decimatedAxis[0::2] = axis[:, 0]
+    decimatedAxis[1::2] = axis[:, -1]
+    decimatedValues[0::2] = values.min(axis=1)
+    decimatedValues[1::2] = values.max(axis=1)
+    return decimatedAxis, decimatedValues
+
+def spectrum(signal, size):
+    """
+    This function returns the zero centered spectrum of a signal. The 
+    spectra of read only signals (the chirps and the sequences) are cached,
+    the cache keeps the signal so its memory can not be reused.
+    :param signal: numpy.array
+    :param size: integer, FFT size
+    :return numpy.array
+    """
+    signal = asarray(signal)
+    if signal.flags.writeable:
+        return fftshift(fft(signal, n=size))
+    key = (signal.__array_interface__["data"][0], signal.shape, \
+        signal.strides, signal.dtype.str, size)
+    if key in spectrumCache:
+        spectrumCache.move_to_end(key)
+        return spectrumCache[key][1]
+    result = fftshift(fft(signal, n=size))
+    result.flags.writeable = False
+    spectrumCache[key] = (signal, result)
+    if len(spectrumCache) > spectrumCacheSize:
+        spectrumCache.popitem(last=False)
+    return result
+
+def amplitudeSpectrum(signal, size):
+    return 20 * log(abs(spectrum(signal, size)))
+
+def phaseSpectrum(signal, size):
+    return (180 / pi) * angle(spectrum(signal, size))
+
+def newFigure(title):
+    """
+    This function creates a figure with the title of the test plots
+    :param title: string
+    :return matplotlib.figure.Figure
+    """
+    figure = plot.figure()
+    figure.suptitle(title, fontsize=20, weight=50)
+    return figure
+
+def linePanel(figure, position, title, axis, lines, labels=None):
+    """
+    This function draws one or more lines in a subplot of the figure, the
+    long ones as their envelope
+    :param figure: matplotlib.figure.Figure
+    :param position: integer or tuple, subplot position
+    :param title: string
+    :param axis: numpy.array, x values
+    :param lines: numpy.array or list of numpy.array, real y values
+    :param labels: list of string, one per line
+    :return matplotlib.axes.Axes
+    """
+    panel = figure.add_subplot(*(position if isinstance(position, tuple) \
+        else (position,)))
+    lines = lines if isinstance(lines, list) else [lines]
+    for iLine, line in enumerate(lines):
+        panel.plot(*envelope(line, axis), label=labels and labels[iLine])
+    panel.title.set_text(title)
+    if labels:
+        panel.legend()
+    panel.grid()
+    return panel
+
+def signalFigure(title, time, signal, frequency, spectrumSignal=None):
+    """
+    This function draws a signal in time and the amplitude and phase of its
+    spectrum
+    :param title: string
+    :param time: numpy.array
+    :param signal: numpy.array, drawn in time (the real part)
+    :param frequency: numpy.array, frequency of every bin of the spectrum
+    :param spectrumSignal: numpy.array, signal of the spectrum, the signal by 
+        default
+    :return matplotlib.figure.Figure
+    """
+    spectrumSignal = signal if spectrumSignal is None else spectrumSignal
+    figure = newFigure(title)
+    linePanel(figure, 211, "Time Domain", time, asarray(signal).real)
+    linePanel(figure, 223, "Frequency Domain: Amplitude", frequency / 1e6, \
+        amplitudeSpectrum(spectrumSignal, frequency.size))
+    linePanel(figure, 224, "Frequency Domain: Phase", frequency / 1e6, \
+        phaseSpectrum(spectrumSignal, frequency.size))
+    return figure
+
+def rangeDopplerExtent(radar, halfSpectrum=True):
+    """
+    This function returns the extent of a range doppler image, velocity on
+    the x axis and range on the y axis
+    :param radar: dict or RadarConfig
+    :param halfSpectrum: boolean
+    :return list
+    """
+    radar = radarConfig(radar)
+    ranges = radar.halfRangeAxis if halfSpectrum else radar.rangeAxis
+    return [radar.velocityAxis[0], radar.velocityAxis[-1], ranges[0], \
+        ranges[-1]]
+
+class RangeDopplerDisplay():
+    """
+    RangeDopplerDisplay class streams range doppler maps into one image, only
+    the data of the image is replaced for every new map.
+    """
+
+    def __init__(self, radar, halfSpectrum=True, title="Range Doppler Map", \
+        decibels=True, limits=None):
+        """
+        RangeDopplerDisplay object constructor
+        :param radar: dict or RadarConfig
+        :param halfSpectrum: boolean, maps of the positive ranges only
+        :param title: string
+        :param decibels: boolean, draw the power in dB
+        :param limits: tuple, fixed color limits, every map is scaled to its
+            own minimum and maximum by default
+        """
+        self.extent = rangeDopplerExtent(radar, halfSpectrum)
+        self.title = title
+        self.decibels = decibels
+        self.limits = limits
+        self.figure = newFigure(title)
+        self.image = None
+
+    def update(self, powerMap, frame=None):
+        """
+        This function draws a new power map of shape (doppler, range)
+        :param powerMap: numpy.array
+        :param frame: integer, shown in the title
+        :return matplotlib.image.AxesImage
+        """
+        data = transpose(10 * log10(powerMap) if self.decibels else powerMap)
+        if self.image is None:
+            panel = self.figure.add_subplot(111)
+            self.image = panel.imshow(data, extent=self.extent, aspect="auto", \
+                origin="lower")
+            panel.set_xlabel("Velocity (m/s)")
+            panel.set_ylabel("Range (m)")
+            self.figure.colorbar(self.image)
+        else:
+            self.image.set_data(data)
+        self.image.set_clim(self.limits or (data.min(), data.max()))
+        if frame is not None:
+            self.figure.suptitle(self.title + " (Frame " + str(frame) + ")", \
+                fontsize=20, weight=50)
+        # Only redrawn when there is a window, saving draws the figure anyway
+        if interactive():
+            self.figure.canvas.draw_idle()
+            self.figure.canvas.flush_events()
+        return self.image
+
+    def save(self, fileName):
+        self.figure.savefig(fileName)
+
+    def close(self):
+        plot.close(self.figure)
+
+def displayStage(display, frames, fileNames=None):
+    """
+    This function draws the power map of every radar cube of a pipeline and
+    passes the frames on
+    :param display: RangeDopplerDisplay
+    :param frames: generator of (frame, radarCube, powerMap), see
+        pipeline.integrationStage
+    :param fileNames: string with a {} for the frame, save every frame
+    :return generator of (frame, radarCube, powerMap)
+    """
+    for iFrame, radarCube, powerMap in frames:
+        display.update(powerMap, iFrame)
+        if fileNames is not None:
+            display.save(fileNames.format(iFrame))
+        yield iFrame, radarCube, powerMap